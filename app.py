@@ -2,35 +2,42 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+# Modules only some requests or commands need (dateutil, babel, forms and
+# flask_wtf, flask_migrate and alembic) are imported where they are used, so
+# starting the app stays cheap. benchmarks/import_time.py checks it.
+import click
+from functools import lru_cache
+from flask import Flask, Blueprint, current_app, render_template, request, Response, flash, redirect, url_for
 from flask_moment import Moment
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
 
 # Additional imports
 import sys
-from flask_migrate import Migrate
-from models import db, Artist, Venue, Show
-from sqlalchemy import func
+from models import db, Artist, Venue, Show, Job, Match
+from search import search
+import queries
+from cache import init_page_cache, init_entity_cache, init_template_caches, cached_page, conditional_page, invalidate_pages
+from instrumentation import init_instrumentation, timed
+from pool import init_pool, dispose_after_fork, pool_metrics
+from replicas import init_replica_binds, init_replicas
+from assets import init_assets
+import counters
+import deletes
+import matches
+import jobs
+import typeahead
 from datetime import datetime
-from flask import jsonify
+from flask import jsonify, abort
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
+moment = Moment()
 
-# connect to a local postgresql database
-db.init_app(app)
-migrate = Migrate(app=app, db=db)
+# Routes are registered on the app by create_app()
+main = Blueprint('main', __name__)
 
 #----------------------------------------------------------------------------#
 # Models. Models can be found in models.py
@@ -40,21 +47,91 @@ migrate = Migrate(app=app, db=db)
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# Compiling a babel pattern and loading the locale are done once per format,
+# instead of on every date rendered
+@lru_cache(maxsize=None)
+def datetime_pattern(format):
+  import babel
+  import babel.dates
+
+  return babel.dates.parse_pattern(format), babel.Locale.parse(babel.dates.LC_TIME)
+
+@timed('datetime')
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  # Views pass datetimes, strings are still parsed for other callers
+  if isinstance(value, str):
+    import dateutil.parser
+    value = dateutil.parser.parse(value)
+
+  pattern, locale = datetime_pattern(DATETIME_FORMATS.get(format, format))
+  return pattern.apply(value, locale)
+
+main.add_app_template_filter(format_datetime, 'datetime')
+
+#----------------------------------------------------------------------------#
+# Page cache invalidation.
+#----------------------------------------------------------------------------#
+
+# Venue pages list the artists of their shows and their matches, artist
+# pages the venues, so changing one also drops the pages of its counterparts
+
+def invalidate_venue_pages(venue_id):
+  artistIds = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).union(
+    db.session.query(Match.artist_id).filter(Match.venue_id == venue_id)
+  )
+  invalidate_pages('venue', venue_id)
+  invalidate_pages('artist', *(artistId for artistId, in artistIds))
+
+def invalidate_artist_pages(artist_id):
+  venueIds = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).union(
+    db.session.query(Match.venue_id).filter(Match.artist_id == artist_id)
+  )
+  invalidate_pages('artist', artist_id)
+  invalidate_pages('venue', *(venueId for venueId, in venueIds))
+
+#----------------------------------------------------------------------------#
+# Page versions.
+#----------------------------------------------------------------------------#
+
+# Versions of the pages answering conditional requests, see queries.py
+
+def venue_version(venue_id):
+  return db.session.execute(queries.venue_version(venue_id, datetime.now())).first()
+
+def artist_version(artist_id):
+  return db.session.execute(queries.artist_version(artist_id, datetime.now())).first()
+
+def artist_list_version():
+  return db.session.execute(queries.artist_list_version()).first()
+
+#----------------------------------------------------------------------------#
+# Request arguments.
+#----------------------------------------------------------------------------#
+
+def listing_filters():
+  # Genre, city and state filters of listings and searches, see queries.py
+  try:
+    return queries.listing_filters(request.values)
+  except ValueError:
+    abort(400)
 
-app.jinja_env.filters['datetime'] = format_datetime
+def show_history():
+  # Upcoming or past shows and the cursor of a venue/artist shows page
+  try:
+    return queries.show_history(request.args)
+  except ValueError:
+    abort(400)
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@main.route('/')
 def index():
   return render_template('pages/home.html')
 
@@ -67,12 +144,13 @@ def index():
 #  Create Venue (Crud)
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
+  from forms import VenueForm
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # Getting the user's input
   data = {}
@@ -110,99 +188,71 @@ def create_venue_submission():
 #  ----------------------------------------------------------------
 
 # Read all venues
-@app.route('/venues')
+@main.route('/venues')
 def venues():
-  # Getting all the areas (City and State)
-  venueAreas = Venue.query.with_entities(func.count(Venue.id), Venue.city, Venue.state).group_by(Venue.city, Venue.state).all()
-  areas = []
-  # Iterating through each area and getting venues
-  for area in venueAreas:
-    areaDict = {}
-    areaDict["city"] = area.city
-    areaDict['state'] = area.state
-    areaDict['venues'] = []
-
-    venues = Venue.query.filter(Venue.state==area.state, Venue.city==area.city).all()
-    for venue in venues:
-      # print(f"{area.city}, {area.state} - {venue.id}, {venue.name}, {venue.upcoming_shows_count()}")
-      venuesDict = {}
-      venuesDict['id'] = venue.id
-      venuesDict['name'] = venue.name
-      venuesDict['num_upcoming_shows'] = venue.upcoming_shows_count()
-
-      areaDict['venues'].append(venuesDict)
-
-    areas.append(areaDict)
-  
-  return render_template('pages/venues.html', areas=areas)
+  # Single query, see queries.py
+  filters = listing_filters()
+  areas = queries.group_areas(db.session.execute(queries.venue_areas(filters)))
+  return render_template('pages/venues.html', areas=areas, filters=filters)
 
 # Read one venue, based on search
-@app.route('/venues/search', methods=['POST'])
+@main.route('/venues/search', methods=['POST'])
 def search_venues():
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-
-  data = []
-  for venue in venues:
-    data.append({
-      "id": venue.id,
-      "name": venue.name,
-      "num_upcoming_shows": venue.upcoming_shows_count()
-    })
-
-  response = {
-    "count": len(venues),
-    "data": data
-  }
-  
-  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+  filters = listing_filters()
+  # Ranked, index backed search with upcoming show counts (see search.py)
+  response = search(Venue, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], filters)
+
+  return render_template('pages/search_venues.html', results=response, search_term=search_term, filters=filters)
 
 # Read one venue, based on ID
-@app.route('/venues/<int:venue_id>')
+@main.route('/venues/<int:venue_id>')
+@conditional_page(venue_version)
+@cached_page('venue', 'venue_id')
 def show_venue(venue_id):
   venue = Venue.query.get_or_404(venue_id)
-  
-  data = {
-    **venue.toJson(),
-    "past_shows": [],
-    "upcoming_shows": []
-  }
-
-  shows = venue.shows
-  for show in shows:
-    artist = show.artist
-    now = datetime.now()
-
-    start_time = show.start_time.strftime("%Y-%m-%dT%H:%M:%S") # Converting datetime to string, Eg: "2019-05-21T21:30:00"
-    if now < show.start_time:
-      data['upcoming_shows'].append({
-        "artist_id": artist.id,
-        "artist_name": artist.name,
-        "artist_image_link": artist.image_link,
-        "start_time": start_time
-      })
-    else:
-       data['past_shows'].append({
-        "artist_id": artist.id,
-        "artist_name": artist.name,
-        "artist_image_link": artist.image_link,
-        "start_time": start_time
-      })
-  # print(data)
+  now = datetime.now()
+
+  perPage = current_app.config['DETAIL_SHOWS_LIMIT']
+
+  # A page of upcoming and of past shows, the rest is on venue_shows()
+  data = queries.detail_page(
+    venue.toJson(),
+    db.session.execute(queries.venue_shows(venue_id, True, now, perPage)),
+    db.session.execute(queries.venue_shows(venue_id, False, now, perPage)),
+    db.session.execute(queries.venue_matches(venue_id, current_app.config['MATCHES_LIMIT'])),
+    perPage
+  )
   return render_template('pages/show_venue.html', venue=data)
 
+# Upcoming or past shows of a venue, paged like /shows
+@main.route('/venues/<int:venue_id>/shows')
+def venue_shows(venue_id):
+  venue = Venue.query.get_or_404(venue_id)
+  upcoming, after = show_history()
+  perPage = current_app.config['SHOWS_PER_PAGE']
+
+  rows = db.session.execute(queries.venue_shows(venue_id, upcoming, datetime.now(), perPage, after)).all()
+  shows, next_cursor = queries.next_page(rows, perPage)
+
+  return render_template(
+    'pages/venue_shows.html', venue=venue, shows=queries.show_rows(shows),
+    upcoming=upcoming, cursor=request.args.get('after'), next_cursor=next_cursor
+  )
+
 
 #  Update Venue (crUd)
 #  ----------------------------------------------------------------
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   venue = Venue.query.get_or_404(venue_id)
+  from forms import VenueForm
   form = VenueForm()
   
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   venue = Venue.query.get_or_404(venue_id)
 
@@ -219,27 +269,34 @@ def edit_venue_submission(venue_id):
   venue.seeking_description = request.form.get('seeking_description')
 
   db.session.commit()
+  invalidate_venue_pages(venue_id)
 
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 
 #  Delete Venue (cruD)
 #  ----------------------------------------------------------------
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # I know this is not the perfect way of deleting a record
   # But I really wanted to give this a try
 
   err = False
+  jobId = None
   try:
     # Try to get the venue
     venue = Venue.query.get_or_404(venue_id)
-    db.session.delete(venue)
-    db.session.commit()
+    # Its shows are deleted by the database, in batches in the background
+    # when there are many of them (see deletes.py)
+    if deletes.show_count(venue) > current_app.config['DELETE_INLINE_MAX_SHOWS']:
+      jobId = jobs.submit('deletes.delete', 'Venue', venue.id)
+      flash('Venue ID: ' + venue_id + ' is being deleted.')
+    else:
+      deletes.delete_entity(Venue, venue.id)
 
-    # on successful delete, flash success
-    flash('Venue ID: ' + venue_id + ' was successfully deleted!')
+      # on successful delete, flash success
+      flash('Venue ID: ' + venue_id + ' was successfully deleted!')
   except Exception:
     err = True
     db.session.rollback()
@@ -250,6 +307,8 @@ def delete_venue(venue_id):
 
   if err:
     return jsonify({'status': 'fail'})
+  elif jobId:
+    return jsonify({'status': 'accepted', 'job_id': jobId}), 202
   else:
     return jsonify({'status': 'success'})
 
@@ -263,12 +322,13 @@ def delete_venue(venue_id):
 #  Create Artist (Crud)
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
+  from forms import ArtistForm
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # Getting the user's input
   data = {}
@@ -305,77 +365,70 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 # Read all artists
-@app.route('/artists')
+@main.route('/artists')
+@conditional_page(artist_list_version)
 def artists():
-  artists = Artist.query.all()
-  return render_template('pages/artists.html', artists=artists)
+  filters = listing_filters()
+  artists = db.session.execute(queries.artist_list(filters)).all()
+  return render_template('pages/artists.html', artists=artists, filters=filters)
 
 # Read one artist, based on search
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/search', methods=['POST'])
 def search_artists():
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-
-  data = []
-  for artist in artists:
-    data.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": artist.upcoming_shows_count()
-    })
-
-  response = {
-    "count": len(artists),
-    "data": data
-  }
-  
-  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+  filters = listing_filters()
+  # Ranked, index backed search with upcoming show counts (see search.py)
+  response = search(Artist, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], filters)
+
+  return render_template('pages/search_artists.html', results=response, search_term=search_term, filters=filters)
 
 # Read one artist, based on ID
-@app.route('/artists/<int:artist_id>')
+@main.route('/artists/<int:artist_id>')
+@conditional_page(artist_version)
+@cached_page('artist', 'artist_id')
 def show_artist(artist_id):
   artist = Artist.query.get_or_404(artist_id)
-  
-  data = {
-    **artist.toJson(),
-    "past_shows": [],
-    "upcoming_shows": []
-  }
-
-  shows = artist.shows
-  for show in shows:
-    venue = show.venue
-    now = datetime.now()
-
-    start_time = show.start_time.strftime("%Y-%m-%dT%H:%M:%S") # Converting datetime to string, Eg: "2019-05-21T21:30:00"
-    if now < show.start_time:
-      data['upcoming_shows'].append({
-        "venue_id": venue.id,
-        "venue_name": venue.name,
-        "venue_image_link": venue.image_link,
-        "start_time": start_time
-      })
-    else:
-       data['past_shows'].append({
-        "venue_id": venue.id,
-        "venue_name": venue.name,
-        "venue_image_link": venue.image_link,
-        "start_time": start_time
-      })
-  # print(data)
+  now = datetime.now()
+
+  perPage = current_app.config['DETAIL_SHOWS_LIMIT']
+
+  # A page of upcoming and of past shows, the rest is on artist_shows()
+  data = queries.detail_page(
+    artist.toJson(),
+    db.session.execute(queries.artist_shows(artist_id, True, now, perPage)),
+    db.session.execute(queries.artist_shows(artist_id, False, now, perPage)),
+    db.session.execute(queries.artist_matches(artist_id, current_app.config['MATCHES_LIMIT'])),
+    perPage
+  )
   return render_template('pages/show_artist.html', artist=data)
 
+# Upcoming or past shows of an artist, paged like /shows
+@main.route('/artists/<int:artist_id>/shows')
+def artist_shows(artist_id):
+  artist = Artist.query.get_or_404(artist_id)
+  upcoming, after = show_history()
+  perPage = current_app.config['SHOWS_PER_PAGE']
+
+  rows = db.session.execute(queries.artist_shows(artist_id, upcoming, datetime.now(), perPage, after)).all()
+  shows, next_cursor = queries.next_page(rows, perPage)
+
+  return render_template(
+    'pages/artist_shows.html', artist=artist, shows=queries.show_rows(shows),
+    upcoming=upcoming, cursor=request.args.get('after'), next_cursor=next_cursor
+  )
+
 #  Update Artist (crUd)
 #  ----------------------------------------------------------------
 
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   artist = Artist.query.get_or_404(artist_id)
+  from forms import ArtistForm
   form = ArtistForm()
 
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   artist = Artist.query.get_or_404(artist_id)
 
@@ -391,27 +444,34 @@ def edit_artist_submission(artist_id):
   artist.seeking_description = request.form.get('seeking_description')
 
   db.session.commit()
+  invalidate_artist_pages(artist_id)
 
-  return redirect(url_for('show_artist', artist_id=artist_id))
+  return redirect(url_for('main.show_artist', artist_id=artist_id))
 
 
 #  Delete Artist (cruD)
 #  ----------------------------------------------------------------
 
-@app.route('/artists/<artist_id>', methods=['DELETE'])
+@main.route('/artists/<artist_id>', methods=['DELETE'])
 def delete_artist(artist_id):
   # I know this is not the perfect way of deleting a record
   # But I really wanted to give this a try
 
   err = False
+  jobId = None
   try:
     # Try to get the artist
     artist = Artist.query.get_or_404(artist_id)
-    db.session.delete(artist)
-    db.session.commit()
+    # Its shows are deleted by the database, in batches in the background
+    # when there are many of them (see deletes.py)
+    if deletes.show_count(artist) > current_app.config['DELETE_INLINE_MAX_SHOWS']:
+      jobId = jobs.submit('deletes.delete', 'Artist', artist.id)
+      flash('Artist ID: ' + artist_id + ' is being deleted.')
+    else:
+      deletes.delete_entity(Artist, artist.id)
 
-    # on successful delete, flash success
-    flash('Artist ID: ' + artist_id + ' was successfully deleted!')
+      # on successful delete, flash success
+      flash('Artist ID: ' + artist_id + ' was successfully deleted!')
   except Exception:
     err = True
     db.session.rollback()
@@ -422,6 +482,8 @@ def delete_artist(artist_id):
 
   if err:
     return jsonify({'status': 'fail'})
+  elif jobId:
+    return jsonify({'status': 'accepted', 'job_id': jobId}), 202
   else:
     return jsonify({'status': 'success'})
 
@@ -431,13 +493,14 @@ def delete_artist(artist_id):
 #  Create Show (Crud)
 #  ----------------------------------------------------------------
 
-@app.route('/shows/create')
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
+  from forms import ShowForm
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # Getting the user's input
   data = {}
@@ -450,7 +513,11 @@ def create_show_submission():
     # Try to insert into the table
     newShow = Show(**data)
     db.session.add(newShow)
+    db.session.flush()
+    counters.add_show(newShow)
     db.session.commit()
+    invalidate_pages('venue', data['venue_id'])
+    invalidate_pages('artist', data['artist_id'])
 
     # on successful db insert, flash success
     flash('Show was successfully listed!')
@@ -467,45 +534,155 @@ def create_show_submission():
 #  Read Shows (cRud)
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
 def shows():
-  data = []
-  shows = Show.query.all()
+  perPage = current_app.config['SHOWS_PER_PAGE']
+
+  # Keyset paginated, a page of shows is a single query (see queries.py)
+  cursor = request.args.get('after')
+  try:
+    after = queries.decode_show_cursor(cursor) if cursor else None
+  except ValueError:
+    abort(400)
+
+  rows = db.session.execute(queries.show_page(after, perPage)).all()
+  data, next_cursor = queries.paginate_shows(rows, perPage)
+
+  return render_template('pages/shows.html', shows=data, cursor=cursor, next_cursor=next_cursor)
+
+
+#  Jobs
+#  ----------------------------------------------------------------
+
+# State of a background job, Eg: a venue deleted in batches (see jobs.py)
+@main.route('/jobs/<int:job_id>')
+def job_status(job_id):
+  job = Job.query.get_or_404(job_id)
+  return jsonify(job.toJson())
 
-  for show in shows:
-    # Getting artist and venue data, to avoid multiple calls to sql database
-    # while assigning data to the object below
-    artist = show.artist
-    venue = show.venue
 
-    start_time = show.start_time.strftime("%Y-%m-%dT%H:%M:%S") # Converting datetime to string, Eg: "2019-05-21T21:30:00"
+#  Matches API
+#  ----------------------------------------------------------------
+
+def matches_limit():
+  try:
+    limit = int(request.args.get('limit', current_app.config['MATCHES_LIMIT']))
+  except ValueError:
+    abort(400)
+  return max(1, min(limit, current_app.config['MATCHES_API_MAX_LIMIT']))
+
+# Best matching artists of a venue seeking talent, see matches.py
+@main.route('/api/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  Venue.query.get_or_404(venue_id)
+  rows = db.session.execute(queries.venue_matches(venue_id, matches_limit()))
+  return jsonify({'venue_id': venue_id, 'matches': queries.show_rows(rows)})
+
+# Best matching venues of an artist seeking venues
+@main.route('/api/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  Artist.query.get_or_404(artist_id)
+  rows = db.session.execute(queries.artist_matches(artist_id, matches_limit()))
+  return jsonify({'artist_id': artist_id, 'matches': queries.show_rows(rows)})
+
+
+#  Typeahead API
+#  ----------------------------------------------------------------
 
-    data.append({
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": start_time
-    })
+# Venues and artists whose name has words starting with the words typed, most
+# upcoming shows first, from the index of the worker (see typeahead.py)
+@main.route('/api/typeahead')
+def typeahead_names():
+  try:
+    text, kind, limit = typeahead.search_args(request.args, current_app.config)
+  except ValueError:
+    abort(400)
+  index = current_app.extensions['typeahead'].get()
+  return jsonify(typeahead.search_results(text, index.search(text, limit, kind), url_for))
 
-  return render_template('pages/shows.html', shows=data)
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@main.route('/metrics/pool')
+def metrics_pool():
+  # Connection pool of the worker process serving the request
+  return jsonify(pool_metrics(db.engine.pool))
+
+@main.route('/metrics/replicas')
+def metrics_replicas():
+  # Lag of the read replicas, as last checked by this worker
+  return jsonify(current_app.extensions['replicas'].metrics())
 
 
 #  Handler Methods
 #  ----------------------------------------------------------------
 
-@app.errorhandler(404)
+@main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
+#----------------------------------------------------------------------------#
+# App factory.
+#----------------------------------------------------------------------------#
+
+def create_app(config='config', warm_up=False):
+  """Builds the app. Under a pre-forking server (see gunicorn.conf.py) pass
+  `warm_up` so workers are forked with templates, forms and dates ready."""
+  app = Flask(__name__)
+  app.config.from_object(config)
+
+  moment.init_app(app)
+
+  # connect to a local postgresql database, pool sized from the config, and
+  # to its read replicas, see replicas.py
+  init_pool(app)
+  init_replica_binds(app)
+  db.init_app(app)
+  init_replicas(app)
+  dispose_after_fork(app, db)
+
+  # `flask db` commands need Flask-Migrate, which loads alembic; it's left
+  # out when serving requests
+  if click.get_current_context(silent=True) is not None:
+    init_migrate(app)
+
+  # detail pages, serialised entities, template fragments and compiled
+  # templates are cached, see cache.py
+  init_page_cache(app)
+  init_entity_cache(app)
+  init_template_caches(app)
+
+  # query count, database and render time of each request, see instrumentation.py
+  init_instrumentation(app)
+
+  # `flask counters` commands maintaining the show counts, see counters.py
+  counters.init_counters(app)
+
+  # venue/artist matches kept up to date on flush, `flask matches` commands,
+  # see matches.py
+  matches.init_matches(app)
+
+  # background jobs queued in the database, `flask jobs` commands, see jobs.py
+  jobs.init_jobs(app)
+
+  # venue/artist names completed from an index in memory, see typeahead.py
+  typeahead.init_typeahead(app)
+
+  # fingerprinted, precompressed static files built by `flask assets build`,
+  # see assets.py
+  init_assets(app)
+
+  app.register_blueprint(main)
+
+  if not app.debug and app.config['ERROR_LOG']:
+    # Opened on the first record, by each worker process
+    file_handler = FileHandler(app.config['ERROR_LOG'], delay=True)
     file_handler.setFormatter(
         Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     )
@@ -514,17 +691,47 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+  if warm_up:
+    warm_up_app(app)
+
+  return app
+
+def init_migrate(app):
+  from flask_migrate import Migrate
+  Migrate(app, db)
+
+def warm_up_app(app):
+  # Compiles every template, builds the form classes and loads the babel
+  # locale once, instead of in each worker on its first requests
+  for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+    app.jinja_env.get_template(name)
+
+  from forms import VenueForm, ArtistForm, ShowForm
+  with app.test_request_context():
+    for form in (VenueForm, ArtistForm, ShowForm):
+      form()
+
+  for format in DATETIME_FORMATS:
+    format_datetime(datetime(2000, 1, 1), format)
+
+  # The typeahead index is loaded before forking too, so workers start with
+  # it. Without the database it's loaded on their first lookup.
+  try:
+    app.extensions['typeahead'].build()
+  except Exception:
+    app.logger.exception('Loading the typeahead index failed')
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
@@ -0,0 +1,406 @@
+#----------------------------------------------------------------------------#
+# Asyncio app.
+#----------------------------------------------------------------------------#
+
+# Serves the read-only pages (listings, searches and detail pages) and the
+# typeahead with Quart on an async SQLAlchemy engine, so a worker keeps many
+# requests in flight instead of blocking on each database round trip.
+# Queries independent of each other, Eg: a venue and its upcoming and past
+# shows, run concurrently on their own connections. Statements and models
+# are the ones the Flask views use (see queries.py), rendered with the same
+# templates.
+#
+# Every other request (forms, writes and static files) goes to the Flask
+# app, run in a thread pool. Both share the page cache, so writes still drop
+# the pages they change.
+#
+# Reads go to the read replicas like in the Flask app (see replicas.py), the
+# replica lag checked by its monitor.
+#
+#   $ hypercorn --workers 4 --bind 0.0.0.0:8000 'asgi:create_asgi_app()'
+
+import asyncio
+from datetime import datetime
+from functools import wraps
+from quart import Quart, Blueprint, current_app, g, render_template, request, session, abort, make_response, url_for
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from app import create_app, format_datetime
+from assets import init_asset_helpers, load_manifest
+from cache import INVALIDATED_KEY, cached_for, page_key, page_validators, not_modified, set_validators, bytecode_cache, configure_templates
+from models import Artist, Venue
+from pool import TimedQueuePool, engine_options
+from replicas import replica_names, request_replica
+from search import search_query, search_results
+import queries
+import typeahead
+
+reads = Blueprint('main', __name__)
+
+
+#  Database
+#  ----------------------------------------------------------------
+
+def async_database_uri(config):
+    # psycopg 3 has an asyncio mode, the same URL works once it's selected
+    if config['ASYNC_DATABASE_URI']:
+        return config['ASYNC_DATABASE_URI']
+    return make_url(config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql+psycopg')
+
+def async_engine_options(config):
+    # Sized like the Flask app's pool, with the asyncio version of QueuePool
+    options = engine_options(config)
+    if options.get('poolclass') is TimedQueuePool:
+        del options['poolclass']
+    return options
+
+def async_replica_uris(config):
+    return {
+        name: make_url(url).set(drivername='postgresql+psycopg')
+        for name, url in zip(replica_names(config), config['DATABASE_REPLICA_URLS'])
+    }
+
+def connect_engine(app):
+    # Engines belong to the event loop they are used in, each worker creates
+    # its own once its loop runs
+    engine = create_async_engine(async_database_uri(app.config), **async_engine_options(app.config))
+    app.extensions['async_replicas'] = {
+        name: create_async_engine(url, **async_engine_options(app.config))
+        for name, url in async_replica_uris(app.config).items()
+    }
+
+    timeout = app.config['DB_STATEMENT_TIMEOUT_MS']
+    if app.config['DB_PGBOUNCER'] and timeout:
+        @event.listens_for(engine.sync_engine, 'begin')
+        def set_local_statement_timeout(conn):
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+    app.extensions['async_engine'] = engine
+    app.extensions['async_session'] = async_sessionmaker(engine, expire_on_commit=False)
+
+def read_engine():
+    # The replica chosen for the request, or the primary
+    replica = g.get('replica')
+    if replica is not None:
+        return current_app.extensions['async_replicas'][replica]
+    return current_app.extensions['async_engine']
+
+async def fetch_all(statement):
+    async with read_engine().connect() as connection:
+        return (await connection.execute(statement)).all()
+
+async def fetch_first(statement):
+    async with read_engine().connect() as connection:
+        return (await connection.execute(statement)).first()
+
+async def fetch_entity(statement):
+    async with current_app.extensions['async_session'](bind=read_engine()) as dbSession:
+        return await dbSession.scalar(statement)
+
+
+#  Page cache and conditional requests
+#  ----------------------------------------------------------------
+
+def cached_page(kind, id_arg):
+    """Async version of cache.cached_page, reading and filling the Flask
+    app's page cache."""
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(**kwargs):
+            if session.get('_flashes'):
+                return await view(**kwargs)
+
+            cache = current_app.extensions['page_cache']
+            key = page_key(kind, kwargs[id_arg])
+            etag = g.get('page_etag')
+            body = cached_for(cache.get(key), etag)
+            if body is not None:
+                return await make_response(body)
+
+            # Rendered from the primary when the replica may not have
+            # replayed the last invalidation, see cache.cached_page
+            since = cache.get(INVALIDATED_KEY)
+            replica = g.get('replica')
+            if replica is not None and since is not None and not current_app.extensions['replicas'].replayed(replica, since):
+                g.replica = None
+
+            response = await make_response(await view(**kwargs))
+            if response.status_code == 200:
+                cache.set(key, (etag, await response.get_data()))
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def conditional_page(version):
+    """Async version of cache.conditional_page, `version` is a coroutine
+    function returning the page version or None."""
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(**kwargs):
+            if session.get('_flashes'):
+                return await view(**kwargs)
+
+            pageVersion = await version(**kwargs)
+            if pageVersion is None:
+                return await view(**kwargs)
+
+            etag, lastModified = page_validators(pageVersion, current_app.extensions['templates_digest'])
+            if not_modified(request, etag, lastModified):
+                response = await make_response('', 304)
+            else:
+                g.page_etag = etag
+                response = await make_response(await view(**kwargs))
+
+            if response.status_code in (200, 304):
+                set_validators(response, etag, lastModified)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+async def venue_version(venue_id):
+    return await fetch_first(queries.venue_version(venue_id, datetime.now()))
+
+async def artist_version(artist_id):
+    return await fetch_first(queries.artist_version(artist_id, datetime.now()))
+
+async def artist_list_version():
+    return await fetch_first(queries.artist_list_version())
+
+
+def listing_filters(values):
+    try:
+        return queries.listing_filters(values)
+    except ValueError:
+        abort(400)
+
+def show_history(values):
+    try:
+        return queries.show_history(values)
+    except ValueError:
+        abort(400)
+
+
+#  Controllers
+#  ----------------------------------------------------------------
+
+@reads.route('/')
+async def index():
+    return await render_template('pages/home.html')
+
+@reads.route('/venues')
+async def venues():
+    filters = listing_filters(request.args)
+    areas = queries.group_areas(await fetch_all(queries.venue_areas(filters)))
+    return await render_template('pages/venues.html', areas=areas, filters=filters)
+
+@reads.route('/venues/search', methods=['POST'])
+async def search_venues():
+    search_term = (await request.form).get('search_term', '')
+    filters = listing_filters(await request.values)
+    rows = await fetch_all(search_query(Venue, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], filters))
+    return await render_template('pages/search_venues.html', results=search_results(rows), search_term=search_term, filters=filters)
+
+@reads.route('/venues/<int:venue_id>')
+@conditional_page(venue_version)
+@cached_page('venue', 'venue_id')
+async def show_venue(venue_id):
+    now = datetime.now()
+    perPage = current_app.config['DETAIL_SHOWS_LIMIT']
+    venue, upcoming, past, matches = await asyncio.gather(
+        fetch_entity(queries.venue_detail(venue_id)),
+        fetch_all(queries.venue_shows(venue_id, True, now, perPage)),
+        fetch_all(queries.venue_shows(venue_id, False, now, perPage)),
+        fetch_all(queries.venue_matches(venue_id, current_app.config['MATCHES_LIMIT']))
+    )
+    if venue is None:
+        abort(404)
+
+    data = queries.detail_page(venue.buildJson(), upcoming, past, matches, perPage)
+    return await render_template('pages/show_venue.html', venue=data)
+
+@reads.route('/venues/<int:venue_id>/shows')
+async def venue_shows(venue_id):
+    upcoming, after = show_history(request.args)
+    perPage = current_app.config['SHOWS_PER_PAGE']
+    venue, rows = await asyncio.gather(
+        fetch_entity(queries.venue_detail(venue_id)),
+        fetch_all(queries.venue_shows(venue_id, upcoming, datetime.now(), perPage, after))
+    )
+    if venue is None:
+        abort(404)
+
+    shows, next_cursor = queries.next_page(rows, perPage)
+    return await render_template(
+        'pages/venue_shows.html', venue=venue, shows=queries.show_rows(shows),
+        upcoming=upcoming, cursor=request.args.get('after'), next_cursor=next_cursor
+    )
+
+@reads.route('/artists')
+@conditional_page(artist_list_version)
+async def artists():
+    filters = listing_filters(request.args)
+    artists = await fetch_all(queries.artist_list(filters))
+    return await render_template('pages/artists.html', artists=artists, filters=filters)
+
+@reads.route('/artists/search', methods=['POST'])
+async def search_artists():
+    search_term = (await request.form).get('search_term', '')
+    filters = listing_filters(await request.values)
+    rows = await fetch_all(search_query(Artist, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], filters))
+    return await render_template('pages/search_artists.html', results=search_results(rows), search_term=search_term, filters=filters)
+
+@reads.route('/artists/<int:artist_id>')
+@conditional_page(artist_version)
+@cached_page('artist', 'artist_id')
+async def show_artist(artist_id):
+    now = datetime.now()
+    perPage = current_app.config['DETAIL_SHOWS_LIMIT']
+    artist, upcoming, past, matches = await asyncio.gather(
+        fetch_entity(queries.artist_detail(artist_id)),
+        fetch_all(queries.artist_shows(artist_id, True, now, perPage)),
+        fetch_all(queries.artist_shows(artist_id, False, now, perPage)),
+        fetch_all(queries.artist_matches(artist_id, current_app.config['MATCHES_LIMIT']))
+    )
+    if artist is None:
+        abort(404)
+
+    data = queries.detail_page(artist.buildJson(), upcoming, past, matches, perPage)
+    return await render_template('pages/show_artist.html', artist=data)
+
+@reads.route('/artists/<int:artist_id>/shows')
+async def artist_shows(artist_id):
+    upcoming, after = show_history(request.args)
+    perPage = current_app.config['SHOWS_PER_PAGE']
+    artist, rows = await asyncio.gather(
+        fetch_entity(queries.artist_detail(artist_id)),
+        fetch_all(queries.artist_shows(artist_id, upcoming, datetime.now(), perPage, after))
+    )
+    if artist is None:
+        abort(404)
+
+    shows, next_cursor = queries.next_page(rows, perPage)
+    return await render_template(
+        'pages/artist_shows.html', artist=artist, shows=queries.show_rows(shows),
+        upcoming=upcoming, cursor=request.args.get('after'), next_cursor=next_cursor
+    )
+
+@reads.route('/shows')
+async def shows():
+    perPage = current_app.config['SHOWS_PER_PAGE']
+
+    cursor = request.args.get('after')
+    try:
+        after = queries.decode_show_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400)
+
+    rows = await fetch_all(queries.show_page(after, perPage))
+    data, next_cursor = queries.paginate_shows(rows, perPage)
+
+    return await render_template('pages/shows.html', shows=data, cursor=cursor, next_cursor=next_cursor)
+
+# Lookups share the Flask app's index, which its writes keep up to date (see
+# typeahead.py)
+@reads.route('/api/typeahead')
+async def typeahead_names():
+    try:
+        text, kind, limit = typeahead.search_args(request.args, current_app.config)
+    except ValueError:
+        abort(400)
+
+    names = current_app.extensions['typeahead']
+    index = names.index
+    if index is None:
+        index = await asyncio.to_thread(names.get)
+    return typeahead.search_results(text, index.search(text, limit, kind), url_for)
+
+@reads.app_errorhandler(404)
+async def not_found_error(error):
+    return await render_template('errors/404.html'), 404
+
+@reads.app_errorhandler(500)
+async def server_error(error):
+    return await render_template('errors/500.html'), 500
+
+
+#----------------------------------------------------------------------------#
+# App factory.
+#----------------------------------------------------------------------------#
+
+class ReadDispatcher:
+    """ASGI app sending the requests the Quart app has a route for to it, and
+    every other one to the Flask app."""
+
+    def __init__(self, reads_app, flask_app):
+        self.reads_app = reads_app
+        self.flask_app = AsyncioWSGIMiddleware(flask_app)
+        self.routes = reads_app.url_map.bind('')
+        self.static_prefix = flask_app.static_url_path + '/'
+
+    def serves(self, scope):
+        # Static files are the Flask app's, built ones served precompressed
+        if scope['path'].startswith(self.static_prefix):
+            return False
+        try:
+            self.routes.match(scope['path'], method=scope['method'])
+        except (NotFound, MethodNotAllowed):
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.serves(scope):
+            await self.flask_app(scope, receive, send)
+        else:
+            await self.reads_app(scope, receive, send)
+
+def create_asgi_app(config='config'):
+    flask_app = create_app(config, warm_up=True)
+
+    app = Quart(__name__)
+    app.config.from_object(config)
+    app.add_template_filter(format_datetime, 'datetime')
+    init_asset_helpers(app, load_manifest(flask_app.static_folder))
+    app.register_blueprint(reads)
+    app.extensions['page_cache'] = flask_app.extensions['page_cache']
+    app.extensions['templates_digest'] = flask_app.extensions['templates_digest']
+    app.extensions['typeahead'] = flask_app.extensions['typeahead']
+    app.extensions['replicas'] = flask_app.extensions['replicas']
+    configure_templates(
+        app.jinja_env,
+        flask_app.extensions['fragment_cache'],
+        app.extensions['templates_digest'],
+        bytecode_cache(app.config, 'quart')
+    )
+
+    @app.before_serving
+    async def connect():
+        connect_engine(app)
+        flask_app.extensions['replicas'].start()
+        flask_app.extensions['typeahead'].start()
+        # Background jobs run in the Flask app's runner (see jobs.py)
+        if flask_app.config['JOBS_IN_APP']:
+            flask_app.extensions['jobs'].start()
+
+    @app.before_request
+    async def route_reads():
+        g.replica = request_replica(flask_app.extensions['replicas'], request.method, session)
+
+    @app.after_serving
+    async def disconnect():
+        await app.extensions['async_engine'].dispose()
+        for engine in app.extensions['async_replicas'].values():
+            await engine.dispose()
+
+    return ReadDispatcher(app, flask_app)
@@ -0,0 +1,222 @@
+#----------------------------------------------------------------------------#
+# Static assets.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+# `flask assets build` copies every file under static/ to static/dist/ with
+# a hash of its content in its name (Eg: img/front-splash.3f9a0c1e.jpg),
+# concatenates the stylesheets and scripts of the layout into the BUNDLES,
+# and writes a gzip (and, with the `brotli` package, a brotli) variant of
+# every text file. static/dist/manifest.json maps source paths and bundle
+# names to the built files.
+#
+# Templates refer to assets through asset_url('img/x.jpg') and
+# asset_urls('main.css'), which return the built files when a manifest
+# exists and the source files otherwise, so nothing has to be built in
+# development. Built files never change under the same name: they are
+# served with a one year, immutable Cache-Control, in their precompressed
+# variant when the client accepts it.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Bundle name: source files, in the order the layout loads them
+BUNDLES = {
+    'main.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+        'css/bonusChanges.css',
+    ],
+    # Loaded in <head>, before the page renders
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    # Deferred, run once the page is parsed and jQuery is loaded
+    'main.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+    ],
+}
+
+COMPRESSED_TYPES = ('.css', '.js', '.map', '.svg', '.ttf', '.otf', '.eot', '.json')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+#  Build
+#  ----------------------------------------------------------------
+
+def fingerprint(path, content):
+    root, ext = posixpath.splitext(path)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+def source_files(static):
+    for directory, dirNames, fileNames in os.walk(static):
+        if os.path.abspath(directory) == os.path.abspath(os.path.join(static, DIST)):
+            dirNames[:] = []
+            continue
+
+        for fileName in fileNames:
+            if not fileName.startswith('.'):
+                path = os.path.relpath(os.path.join(directory, fileName), static)
+                yield path.replace(os.sep, '/')
+
+def rewrite_css_urls(css, source, manifest):
+    """Points the relative url()s of a stylesheet at `source` to the built
+    files, relative to dist/."""
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        if target not in manifest:
+            # Missing file, the original path resolves the same from dist/
+            return match.group(0)
+        return f'url({quote}{posixpath.relpath(manifest[target], DIST)}{suffix}{quote})'
+
+    return CSS_URL.sub(replace, css)
+
+def write_file(dist, path, content):
+    target = os.path.join(dist, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as file:
+        file.write(content)
+
+    if path.endswith(COMPRESSED_TYPES):
+        with open(target + '.gz', 'wb') as file:
+            file.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+        try:
+            import brotli
+        except ImportError:
+            return
+        with open(target + '.br', 'wb') as file:
+            file.write(brotli.compress(content, quality=11))
+
+def build(static):
+    """Builds static/dist/ and its manifest, returns the manifest."""
+    dist = os.path.join(static, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+
+    for path in sorted(source_files(static)):
+        with open(os.path.join(static, *path.split('/')), 'rb') as file:
+            content = file.read()
+        manifest[path] = posixpath.join(DIST, fingerprint(path, content))
+        write_file(dist, posixpath.relpath(manifest[path], DIST), content)
+
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static, *source.split('/')), encoding='utf-8') as file:
+                content = file.read()
+            if name.endswith('.css'):
+                content = rewrite_css_urls(content, source, manifest)
+            parts.append(content)
+
+        # Scripts are separated so one lacking its final semicolon doesn't
+        # run into the next
+        content = (';\n' if name.endswith('.js') else '\n').join(parts).encode('utf-8')
+        manifest[name] = posixpath.join(DIST, fingerprint(name, content))
+        write_file(dist, posixpath.relpath(manifest[name], DIST), content)
+
+    with open(os.path.join(dist, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    return manifest
+
+def load_manifest(static):
+    try:
+        with open(os.path.join(static, DIST, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+#  Templates
+#  ----------------------------------------------------------------
+
+def init_asset_helpers(app, manifest):
+    """Adds asset_url() and asset_urls() to the templates of `app`, a Flask
+    or a Quart app."""
+
+    def static_url(path):
+        return f'{app.static_url_path}/{path}'
+
+    def asset_url(path):
+        if manifest is not None and path in manifest:
+            return static_url(manifest[path])
+        return static_url(path)
+
+    def asset_urls(bundle):
+        # The bundle when built, its source files otherwise
+        if manifest is not None and bundle in manifest:
+            return [static_url(manifest[bundle])]
+        return [static_url(source) for source in BUNDLES[bundle]]
+
+    app.jinja_env.globals.update(asset_url=asset_url, asset_urls=asset_urls)
+
+
+#  Serving
+#  ----------------------------------------------------------------
+
+def send_static_file(filename):
+    """Static files view, built files are served for good and precompressed."""
+    static = current_app.static_folder
+    if not filename.startswith(DIST + '/'):
+        return current_app.send_static_file(filename)
+
+    accepted = request.accept_encodings
+    for encoding, extension in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[encoding] and os.path.isfile(os.path.join(static, filename + extension)):
+            response = send_from_directory(
+                static, filename + extension,
+                mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                max_age=None, conditional=True, etag=True
+            )
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(static, filename, max_age=None)
+
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+assets_cli = AppGroup('assets', help='Build the static assets.')
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint, bundle and precompress static/ into static/dist/."""
+    manifest = build(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} assets into {os.path.join(current_app.static_folder, DIST)}')
+
+def init_assets(app):
+    app.cli.add_command(assets_cli)
+    init_asset_helpers(app, load_manifest(app.static_folder))
+    # Replaces Flask's static files view
+    app.view_functions['static'] = send_static_file
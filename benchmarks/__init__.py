@@ -0,0 +1,32 @@
+#----------------------------------------------------------------------------#
+# Benchmarks.
+#----------------------------------------------------------------------------#
+
+# Benchmarks run against their own database, given by BENCHMARK_DATABASE_URL,
+# which is emptied and seeded with synthetic data. Run them from the project
+# root, Eg: python -m benchmarks.routes --help
+
+import os
+import sys
+import config
+
+
+def configure():
+    # Points the app at the benchmark database and turns caches off, so
+    # every request does its full work. Must run before `app` is imported.
+    url = os.environ.get('BENCHMARK_DATABASE_URL')
+    if not url:
+        sys.exit('BENCHMARK_DATABASE_URL is not set. Benchmarks empty the database they run on, use a dedicated one.')
+
+    config.SQLALCHEMY_DATABASE_URI = url
+    config.WTF_CSRF_ENABLED = False
+    config.PAGE_CACHE_BACKEND = 'cache.NullCache'
+    config.ENTITY_CACHE_BACKEND = 'cache.NullCache'
+    config.FRAGMENT_CACHE_BACKEND = 'cache.NullCache'
+    config.JOBS_IN_APP = False
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,83 @@
+#----------------------------------------------------------------------------#
+# Datetime filter benchmark.
+#----------------------------------------------------------------------------#
+
+# Renders a page of shows with the `datetime` filter the way views used to
+# feed it (strftime, then dateutil re-parsing and babel compiling the pattern
+# on every call) and the way they do now (datetimes passed as they are, with
+# compiled patterns cached). Needs no database.
+#
+#   python -m benchmarks.datetime_filter --shows 1000
+
+import argparse
+import time
+from datetime import datetime, timedelta
+import babel.dates
+import dateutil.parser
+import config
+from app import create_app, format_datetime
+from benchmarks import percentile
+
+# The list of shows is fragment cached, turn it off so every render formats
+# every date
+config.FRAGMENT_CACHE_BACKEND = 'cache.NullCache'
+app = create_app()
+
+
+def legacy_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def show_list(count, as_string):
+    now = datetime.now()
+    shows = []
+    for n in range(count):
+        start_time = now + timedelta(hours=7 * n)
+        shows.append({
+            "venue_id": n,
+            "venue_name": f'Venue {n}',
+            "artist_id": n,
+            "artist_name": f'Artist {n}',
+            "artist_image_link": 'https://images.example.com/artist.jpg',
+            "start_time": start_time.strftime("%Y-%m-%dT%H:%M:%S") if as_string else start_time
+        })
+    return shows
+
+
+def render(shows, repeat):
+    template = app.jinja_env.get_template('pages/shows.html')
+    timings = []
+    with app.test_request_context('/shows'):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            template.render(shows=shows, cursor=None, next_cursor=None)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render time of a show list, legacy vs cached datetime filter.')
+    parser.add_argument('--shows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app.jinja_env.filters['datetime'] = legacy_format_datetime
+    legacy = render(show_list(args.shows, as_string=True), args.repeat)
+
+    app.jinja_env.filters['datetime'] = format_datetime
+    cached = render(show_list(args.shows, as_string=False), args.repeat)
+
+    print(f'Rendering {args.shows} shows, {args.repeat} times')
+    print(f'{"filter":10} {"p50 ms":>8} {"p95 ms":>8}')
+    print(f'{"legacy":10} {percentile(legacy, 50):8.1f} {percentile(legacy, 95):8.1f}')
+    print(f'{"cached":10} {percentile(cached, 50):8.1f} {percentile(cached, 95):8.1f}')
+    print(f'Speedup: {percentile(legacy, 50) / percentile(cached, 50):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#----------------------------------------------------------------------------#
+# Genre filter benchmark.
+#----------------------------------------------------------------------------#
+
+# Times the filtered listings and searches on growing datasets, with the
+# planner free to use the GIN indexes on genres and with index scans turned
+# off, which reads every row like the listings did before the indexes.
+# Exits with status 1 when a filtered artist listing doesn't use its index
+# on the largest dataset, or when its time grows as fast as the table.
+#
+#   BENCHMARK_DATABASE_URL=postgresql://localhost/fyyur_bench \
+#     python -m benchmarks.genre_filter --sizes 10000,100000,500000
+
+import argparse
+import sys
+import time
+from benchmarks import configure, percentile
+
+configure()
+
+from app import create_app
+from models import db, Artist
+from search import search_query
+from benchmarks.seed import seed
+import queries
+
+
+def filters(genres, match='all', city=None, state=None):
+    return {"genres": genres, "match": match, "city": city, "state": state}
+
+# (name, statement) of each measured query; the seeded artists have two
+# genres each, about one in a hundred has both Blues and Hip-Hop
+CASES = [
+    ('artists: Blues and Hip-Hop', lambda: queries.artist_list(filters(['Blues', 'Hip-Hop']))),
+    ('artists: Blues and Hip-Hop, Austin TX', lambda: queries.artist_list(filters(['Blues', 'Hip-Hop'], city='Austin', state='TX'))),
+    ('venues: Blues and Hip-Hop', lambda: queries.venue_areas(filters(['Blues', 'Hip-Hop']))),
+    ('search artists: Blues and Hip-Hop', lambda: search_query(Artist, 'band', 50, filters(['Blues', 'Hip-Hop']))),
+]
+
+# The case checked against the budget
+CHECKED = 'artists: Blues and Hip-Hop'
+INDEX = 'ix_artist_genres'
+
+
+def timed(statement, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        rows = db.session.execute(statement).all()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return percentile(latencies, 50), len(rows)
+
+
+def plan(statement):
+    compiled = statement.compile(db.engine)
+    rows = db.session.connection().exec_driver_sql('EXPLAIN ' + str(compiled), compiled.params)
+    return '\n'.join(row[0] for row in rows)
+
+
+def measure(requests):
+    results = {}
+    for name, statement in CASES:
+        indexed, matches = timed(statement(), requests)
+        indexedPlan = plan(statement())
+
+        db.session.execute(db.text('SET LOCAL enable_bitmapscan = off'))
+        db.session.execute(db.text('SET LOCAL enable_indexscan = off'))
+        scanned, _ = timed(statement(), requests)
+        db.session.rollback()
+
+        # Bitmap Index Scan included
+        results[name] = (indexed, scanned, matches, 'Index Scan' in indexedPlan, indexedPlan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filtered listings on growing datasets, with and without the GIN indexes.')
+    parser.add_argument('--sizes', default='10000,100000,500000', help='comma separated numbers of artists')
+    parser.add_argument('--requests', type=int, default=20, help='runs of each query')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    app = create_app()
+    runs = {}
+
+    print(f'{"artists":>8} {"query":40} {"matches":>8} {"p50 ms":>8} {"no index":>9} {"index":>6}')
+    with app.app_context():
+        for size in sizes:
+            # As many venues as a fifth of the artists, and no shows
+            seed(size // 5, size, 0)
+            runs[size] = measure(args.requests)
+
+            for name, (indexed, scanned, matches, usesIndex, _) in runs[size].items():
+                print(f'{size:8} {name:40} {matches:8} {indexed:8.2f} {scanned:9.2f} {"yes" if usesIndex else "no":>6}')
+
+    failures = []
+    smallest, largest = min(sizes), max(sizes)
+    indexed, _, _, usesIndex, largestPlan = runs[largest][CHECKED]
+    if not usesIndex or INDEX not in largestPlan:
+        failures.append(f'{CHECKED} does not use {INDEX} with {largest} artists:\n{largestPlan}')
+
+    if largest > smallest:
+        growth = indexed / runs[smallest][CHECKED][0]
+        print(f'\n{CHECKED}: {growth:.1f}x slower for {largest / smallest:.0f}x the artists')
+        if growth >= largest / smallest:
+            failures.append(f'{CHECKED} grew {growth:.1f}x for {largest / smallest:.0f}x the artists')
+
+    if failures:
+        print('\nGenre filter benchmark failed:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
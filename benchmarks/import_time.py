@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Import time benchmark.
+#----------------------------------------------------------------------------#
+
+# Measures the cold start of a worker, importing app and calling create_app(),
+# in fresh interpreters with `python -X importtime`. Exits with status 1 when
+# the median startup exceeds the budget, or when a module meant to be loaded
+# lazily is imported at startup. Needs no database.
+#
+#   python -m benchmarks.import_time --budget-ms 1000
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Only needed by some requests or commands, see the imports of app.py
+LAZY_MODULES = ('alembic', 'flask_migrate', 'dateutil', 'babel', 'flask_wtf', 'wtforms', 'forms')
+
+STARTUP = '''
+import sys, time
+started = time.perf_counter()
+import app
+app.create_app()
+print(f'{(time.perf_counter() - started) * 1000:.3f}')
+print(','.join(sorted(sys.modules)))
+'''
+
+
+def app_imports(output):
+    """Modules imported directly by app.py and the milliseconds each took,
+    everything it pulled in included, from `-X importtime` output."""
+    # Lines look like "import time: self [us] | cumulative | package", nested
+    # imports are indented and listed before the module importing them
+    children = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == 'app':
+                return children
+            children = []
+
+    return []
+
+
+def measure():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP],
+        capture_output=True, text=True, check=True
+    )
+    total, modules = result.stdout.splitlines()[-2:]
+    return float(total), modules.split(','), app_imports(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the app, with a budget.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1000, help='median import app + create_app()')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    median = statistics.median(total for total, _, _ in runs)
+    _, modules, app = runs[-1]
+
+    print('Heaviest imports of app.py (last run):')
+    for name, ms in sorted(app, key=lambda item: item[1], reverse=True)[:10]:
+        print(f'  {name:32} {ms:8.1f} ms')
+    print(f'\nStartup: median {median:.1f} ms over {args.runs} runs, budget {args.budget_ms:.0f} ms')
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f'startup took {median:.1f} ms, budget is {args.budget_ms:.0f} ms')
+
+    eager = sorted({name.split('.')[0] for name in modules} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f'imported at startup, should be lazy: {", ".join(eager)}')
+
+    if failures:
+        print('\nStartup budget exceeded:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#----------------------------------------------------------------------------#
+# Route benchmark.
+#----------------------------------------------------------------------------#
+
+# Drives every route of the app through the Flask test client on a seeded
+# dataset, and reports latency percentiles and SQL queries per request.
+# Each route has a query budget that must not grow with the data; exceeding
+# one (typically an N+1 slipping back in) makes the run exit with status 1.
+#
+#   BENCHMARK_DATABASE_URL=postgresql://localhost/fyyur_bench \
+#     python -m benchmarks.routes --venues 10000 --artists 50000 --shows 1000000
+
+import argparse
+import sys
+import time
+from benchmarks import configure, percentile
+
+configure()
+
+from sqlalchemy import event
+from app import create_app
+from models import db
+from jobs import submit
+from benchmarks.seed import seed
+
+
+class QueryCounter:
+    """Counts the statements sent to the database while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self.on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self.on_execute)
+
+
+def form(**fields):
+    return lambda n: {key: value(n) if callable(value) else value for key, value in fields.items()}
+
+VENUE_FORM = form(
+    name=lambda n: f'Benchmark Venue {n}', city='Austin', state='TX',
+    address='1 Benchmark Road', phone='555-0100', genres=['Jazz', 'Blues'],
+    facebook_link='https://www.facebook.com/benchmark', seeking_talent='y'
+)
+ARTIST_FORM = form(
+    name=lambda n: f'Benchmark Artist {n}', city='Austin', state='TX',
+    phone='555-0100', genres=['Jazz', 'Blues'],
+    facebook_link='https://www.facebook.com/benchmark', seeking_venue='y'
+)
+
+# (name, method, path for the n-th request, form data, status, query budget)
+# Creates render the home page, edits redirect to the edited page, deletes of
+# venues/artists with many shows are accepted for the background. Write
+# routes work on their own ids, deletes take the highest ids so the rows
+# other routes read stay in place. Pages answering conditional requests run
+# one more query, for their version. Deletes look up the matches they
+# remove, whose pages are dropped. Detail pages list a bounded page of
+# upcoming and past shows, the shows pages of a venue/artist the rest. The
+# typeahead index is loaded by the first, unmeasured, lookup.
+def routes(venues, artists, job_id):
+    return [
+        ('index', 'GET', lambda n: '/', None, 200, 0),
+        ('venues', 'GET', lambda n: '/venues', None, 200, 1),
+        ('venues_by_genre', 'GET', lambda n: '/venues?genre=Jazz&genre=Blues&match=any&state=TX', None, 200, 1),
+        ('search_venues', 'POST', lambda n: '/venues/search', form(search_term='hall 1'), 200, 1),
+        ('show_venue', 'GET', lambda n: f'/venues/{1 + n % venues}', None, 200, 6),
+        ('venue_past_shows', 'GET', lambda n: f'/venues/{1 + n % venues}/shows', None, 200, 2),
+        ('venue_matches', 'GET', lambda n: f'/api/venues/{1 + n % venues}/matches', None, 200, 2),
+        ('create_venue_form', 'GET', lambda n: '/venues/create', None, 200, 0),
+        ('create_venue_submission', 'POST', lambda n: '/venues/create', VENUE_FORM, 200, 2),
+        ('edit_venue', 'GET', lambda n: f'/venues/{1 + n % venues}/edit', None, 200, 1),
+        ('edit_venue_submission', 'POST', lambda n: f'/venues/{1 + n % venues}/edit', VENUE_FORM, 302, 5),
+        ('artists', 'GET', lambda n: '/artists', None, 200, 2),
+        ('artists_by_genre', 'GET', lambda n: '/artists?genre=Blues&genre=Hip-Hop', None, 200, 2),
+        ('search_artists', 'POST', lambda n: '/artists/search', form(search_term='band 1'), 200, 1),
+        ('show_artist', 'GET', lambda n: f'/artists/{1 + n % artists}', None, 200, 6),
+        ('artist_past_shows', 'GET', lambda n: f'/artists/{1 + n % artists}/shows', None, 200, 2),
+        ('artist_matches', 'GET', lambda n: f'/api/artists/{1 + n % artists}/matches', None, 200, 2),
+        ('create_artist_form', 'GET', lambda n: '/artists/create', None, 200, 0),
+        ('create_artist_submission', 'POST', lambda n: '/artists/create', ARTIST_FORM, 200, 2),
+        ('edit_artist', 'GET', lambda n: f'/artists/{1 + n % artists}/edit', None, 200, 1),
+        ('edit_artist_submission', 'POST', lambda n: f'/artists/{1 + n % artists}/edit', ARTIST_FORM, 302, 5),
+        ('shows', 'GET', lambda n: '/shows', None, 200, 1),
+        ('typeahead', 'GET', lambda n: f'/api/typeahead?q=the band {n}', None, 200, 0),
+        ('create_shows', 'GET', lambda n: '/shows/create', None, 200, 0),
+        ('create_show_submission', 'POST', lambda n: '/shows/create',
+            form(venue_id=lambda n: 1 + n % venues, artist_id=lambda n: 1 + n % artists, start_time='2030-01-01 20:00:00'), 200, 4),
+        ('job_status', 'GET', lambda n: f'/jobs/{job_id}', None, 200, 1),
+        ('pool_metrics', 'GET', lambda n: '/metrics/pool', None, 200, 0),
+        ('replica_metrics', 'GET', lambda n: '/metrics/replicas', None, 200, 0),
+        ('delete_venue', 'DELETE', lambda n: f'/venues/{venues - n}', None, (200, 202), 9),
+        ('delete_artist', 'DELETE', lambda n: f'/artists/{artists - n}', None, (200, 202), 9),
+    ]
+
+
+def run(client, counter, method, path, data, status, requests):
+    latencies = []
+    queries = []
+    for n in range(requests):
+        with counter:
+            started = time.perf_counter()
+            response = client.open(path(n), method=method, data=data(n) if data else None)
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+
+        if response.status_code not in (status if isinstance(status, tuple) else (status,)):
+            raise RuntimeError(f'{method} {path(n)} returned {response.status_code}, expected {status}')
+
+    return latencies, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and SQL queries of every route, with query budgets.')
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=50000)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=20, help='requests per route')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data of a previous run')
+    parser.add_argument('--only', help='comma separated route names to run')
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    failures = []
+
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.venues, args.artists, args.shows)
+        counter = QueryCounter(db.engine)
+
+    # A job for /jobs/<id> to report, left queued as no runner is started
+    with app.test_request_context():
+        jobId = submit('counters.roll')
+
+    selected = args.only.split(',') if args.only else None
+
+    print(f'{"route":28} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} {"queries":>8} {"budget":>7}')
+    for name, method, path, data, expected, budget in routes(args.venues, args.artists, jobId):
+        if selected and name not in selected:
+            continue
+
+        # The first request compiles templates, it isn't measured
+        latencies, queries = run(client, counter, method, path, data, expected, args.requests + 1)
+        latencies, queries = latencies[1:], queries[1:]
+
+        status = '' if budget is None else str(budget)
+        if budget is not None and max(queries) > budget:
+            failures.append(f'{name}: {max(queries)} queries, budget is {budget}')
+            status += ' FAIL'
+
+        print(f'{name:28} {percentile(latencies, 50):8.1f} {percentile(latencies, 95):8.1f} '
+              f'{percentile(latencies, 99):8.1f} {max(latencies):8.1f} {max(queries):8} {status:>7}')
+
+    if failures:
+        print('\nQuery budgets exceeded:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
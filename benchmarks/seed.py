@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------#
+# Synthetic dataset.
+#----------------------------------------------------------------------------#
+
+import time
+from datetime import datetime
+from models import db
+import counters
+import matches
+from forms import state_list, genres_list
+
+CITIES = [
+    'San Francisco', 'New York', 'Austin', 'Chicago', 'Seattle', 'Denver',
+    'Boston', 'Nashville', 'New Orleans', 'Portland', 'Atlanta', 'Detroit',
+]
+
+# Rows are generated by Postgres with generate_series, a million shows take
+# seconds instead of the minutes the ORM would need. Shows are spread from
+# three years ago to one year ahead, so about a quarter are upcoming.
+
+# Lists of names the generated rows pick from
+PARAMS = '''
+WITH params AS (
+    SELECT CAST(:cities AS text[]) AS cities,
+        CAST(:states AS text[]) AS states,
+        CAST(:genres AS text[]) AS genres
+)
+'''
+
+SEED_VENUES = PARAMS + '''
+INSERT INTO "Venue" (name, city, state, address, phone, genres, image_link,
+    facebook_link, website, seeking_talent, seeking_description)
+SELECT
+    'The ' || p.cities[1 + g % cardinality(p.cities)] || ' Hall ' || g,
+    p.cities[1 + g % cardinality(p.cities)],
+    p.states[1 + g % cardinality(p.states)],
+    g || ' Main Street',
+    '555-' || lpad((g % 10000)::text, 4, '0'),
+    ARRAY[p.genres[1 + g % cardinality(p.genres)], p.genres[1 + (g / 7) % cardinality(p.genres)]],
+    'https://images.example.com/venues/' || g || '.jpg',
+    'https://www.facebook.com/venue' || g,
+    'https://venue' || g || '.example.com',
+    g % 3 = 0,
+    CASE WHEN g % 3 = 0 THEN 'Looking for local bands' END
+FROM generate_series(1, :count) AS g, params AS p
+'''
+
+SEED_ARTISTS = PARAMS + '''
+INSERT INTO "Artist" (name, city, state, phone, genres, image_link,
+    facebook_link, website, seeking_venue, seeking_description)
+SELECT
+    'The ' || p.genres[1 + g % cardinality(p.genres)] || ' Band ' || g,
+    p.cities[1 + (g / 3) % cardinality(p.cities)],
+    p.states[1 + (g / 3) % cardinality(p.states)],
+    '555-' || lpad((g % 10000)::text, 4, '0'),
+    ARRAY[p.genres[1 + g % cardinality(p.genres)], p.genres[1 + (g / 5) % cardinality(p.genres)]],
+    'https://images.example.com/artists/' || g || '.jpg',
+    'https://www.facebook.com/artist' || g,
+    'https://artist' || g || '.example.com',
+    g % 4 = 0,
+    CASE WHEN g % 4 = 0 THEN 'Looking for shows this summer' END
+FROM generate_series(1, :count) AS g, params AS p
+'''
+
+SEED_SHOWS = '''
+INSERT INTO "Show" (venue_id, artist_id, start_time)
+SELECT
+    v.min_id + floor(random() * (v.max_id - v.min_id + 1))::int,
+    a.min_id + floor(random() * (a.max_id - a.min_id + 1))::int,
+    date_trunc('hour', CAST(:now AS timestamp) - interval '3 years' + random() * interval '4 years')
+FROM generate_series(1, :count),
+    (SELECT min(id) AS min_id, max(id) AS max_id FROM "Venue") AS v,
+    (SELECT min(id) AS min_id, max(id) AS max_id FROM "Artist") AS a
+'''
+
+
+def seed(venues, artists, shows):
+    """Empties the database and fills it with the given number of rows."""
+    params = {
+        'cities': CITIES,
+        'states': [state for state, _ in state_list],
+        'genres': [genre for genre, _ in genres_list],
+    }
+
+    started = time.perf_counter()
+    db.session.execute(db.text('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY CASCADE'))
+    db.session.execute(db.text(SEED_VENUES).bindparams(count=venues, **params))
+    db.session.execute(db.text(SEED_ARTISTS).bindparams(count=artists, **params))
+    db.session.execute(db.text(SEED_SHOWS).bindparams(count=shows, now=datetime.now()))
+    counters.rebuild()
+    matches.rebuild()
+    db.session.commit()
+
+    for table in ('Venue', 'Artist', 'Show', 'Match'):
+        db.session.execute(db.text(f'ANALYZE "{table}"'))
+    db.session.commit()
+
+    print(f'Seeded {venues} venues, {artists} artists and {shows} shows in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,206 @@
+#----------------------------------------------------------------------------#
+# Typeahead benchmark.
+#----------------------------------------------------------------------------#
+
+# Times lookups in the typeahead index (see typeahead.py) holding names like
+# the seeded ones, from one letter typed to whole names, for prefixes
+# matching most names, few or none, and for words many names have but few
+# together. A venue is renamed between lookups, as writes do. Exits with
+# status 1 when the p99 of a lookup exceeds the budget. Needs no database.
+#
+# The same lookups are timed in a plain sorted list of the names' words
+# searched with bisect, which ranks every name a prefix matches: hundreds of
+# milliseconds for the first letters typed, why the index keeps the best
+# names of prefixes. Before timing, an index updated change by change (puts,
+# renames, removals, shows) is checked to answer every lookup like one
+# rebuilt from the same names, and like the sorted list, exiting with status
+# 1 when one differs.
+#
+#   python -m benchmarks.typeahead --names 100000 --budget-ms 1
+
+import argparse
+import heapq
+import random
+import sys
+import time
+from bisect import bisect_left
+import config
+from forms import genres_list
+from typeahead import PrefixIndex, KINDS, WORD_END, normalize, name_words, has_words, rank, result
+from benchmarks import percentile
+from benchmarks.seed import CITIES
+
+TYPED = [
+    't', 'th', 'the', 'the ', 'the j', 'the ja', 'jazz', 'jazz band', 'band', 'ha', 'hall',
+    'new', 'new york hall', 'the san francisco hall 1', 'band 1', 'band 12', 'band 123',
+    '1', '42', 'the rock band 9999', 'zz', 'hall band', 'Café', 'rock jazz', 'the rock j',
+]
+# Words of the names changes give, sharing prefixes with the indexed ones
+CHECKED_WORDS = ['The', 'Hall', 'Band', 'Jazz', 'Jam', 'Café', 'Cafe', 'New', 'York', 'Rock', 'Rocket', *map(str, range(1, 60))]
+
+
+def index_rows(names):
+    genres = [genre for genre, _ in genres_list]
+    venues = names // 5
+    rows = [('venue', n, f'The {CITIES[n % len(CITIES)]} Hall {n}', random.randrange(50)) for n in range(1, venues + 1)]
+    rows += [('artist', n, f'The {genres[n % len(genres)]} Band {n}', random.randrange(20)) for n in range(1, names - venues + 1)]
+    return rows
+
+
+class SortedNames:
+    """The names' words in a sorted list, the names a prefix matches ranked
+    on every lookup."""
+
+    def __init__(self, rows):
+        self.entries = {}
+        self.words = []
+        for kind, entityId, name, count in rows:
+            words = name_words(name)
+            self.entries[kind, entityId] = (name, count, words)
+            self.words += [(word, kind, entityId) for word in words.split()]
+        self.words.sort()
+
+    def search(self, text, limit, kind=None):
+        typed = normalize(text).split()
+        if not typed or limit < 1:
+            return []
+
+        # The names of the typed word fewest names have
+        ranges = []
+        for prefix in typed:
+            low = bisect_left(self.words, (prefix,))
+            ranges.append((bisect_left(self.words, (prefix + WORD_END,), low), low))
+        high, low = min(ranges, key=lambda bounds: bounds[0] - bounds[1])
+
+        found = set()
+        for _, entityKind, entityId in self.words[low:high]:
+            name, count, words = self.entries[entityKind, entityId]
+            if (kind is None or entityKind == kind) and has_words(words, typed):
+                found.add(rank(entityKind, entityId, name, count))
+        return [result(ranked) for ranked in heapq.nsmallest(limit, found)]
+
+
+#  Updates
+#  ----------------------------------------------------------------
+
+def random_name(words):
+    return ' '.join(random.choice(words) for _ in range(random.randint(1, 4)))
+
+def update_randomly(index, rows):
+    """Makes a random change to `index`, and the same to `rows` (kind, id):
+    (name, count)."""
+    kind = random.choice(KINDS)
+    entityId = random.randint(1, len(rows))
+    entry = rows.get((kind, entityId))
+    change = random.random()
+    if change < 0.4:
+        count = random.choice((None, random.randrange(30)))
+        name = random_name(CHECKED_WORDS)
+        index.put(kind, entityId, name, count)
+        rows[kind, entityId] = (name, entry[1] if count is None and entry else count or 0)
+    elif change < 0.6:
+        index.remove(kind, entityId)
+        rows.pop((kind, entityId), None)
+    elif change < 0.65:
+        # A venue/artist whose name was cleared
+        index.put(kind, entityId, None)
+        rows.pop((kind, entityId), None)
+    else:
+        shows = random.randint(1, 3)
+        index.add_upcoming(kind, entityId, shows)
+        if entry:
+            rows[kind, entityId] = (entry[0], entry[1] + shows)
+
+def check_updates(names, changes, lookups):
+    """Differences between an index updated `changes` times, one rebuilt from
+    the names it ended with and the sorted list of them."""
+    rows = {(kind, entityId): (name, count) for kind, entityId, name, count in index_rows(names)}
+    index = PrefixIndex([(*key, *entry) for key, entry in rows.items()], keep=2 * config.TYPEAHEAD_MAX_LIMIT)
+
+    differences = []
+    for done in range(1, changes + 1):
+        update_randomly(index, rows)
+        if done % max(1, changes // 4) and done != changes:
+            continue
+
+        endRows = [(*key, *entry) for key, entry in rows.items()]
+        rebuilt = PrefixIndex(endRows, keep=2 * config.TYPEAHEAD_MAX_LIMIT)
+        sortedNames = SortedNames(endRows)
+        typed = TYPED + [random_name(CHECKED_WORDS)[:random.randint(1, 12)] for _ in range(lookups)]
+        for text in typed:
+            for kind in (None, *KINDS):
+                for limit in (1, config.TYPEAHEAD_LIMIT, config.TYPEAHEAD_MAX_LIMIT):
+                    expected = rebuilt.search(text, limit, kind)
+                    if index.search(text, limit, kind) != expected:
+                        differences.append(f'{text!r} ({kind or "all"}, limit {limit}) after {done} changes: differs from a rebuilt index')
+                    if sortedNames.search(text, limit, kind) != expected:
+                        differences.append(f'{text!r} ({kind or "all"}, limit {limit}) after {done} changes: differs from the sorted list')
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of typeahead lookups, with a budget.')
+    parser.add_argument('--names', type=int, default=100000, help='venues and artists, a fifth of them venues')
+    parser.add_argument('--limit', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=200, help='lookups per prefix')
+    parser.add_argument('--baseline-repeat', type=int, default=5, help='lookups per prefix in the sorted list')
+    parser.add_argument('--budget-ms', type=float, default=1, help='p99 of a lookup')
+    parser.add_argument('--check-names', type=int, default=5000, help='names of the index updates are checked on')
+    parser.add_argument('--check-changes', type=int, default=4000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    differences = check_updates(args.check_names, args.check_changes, lookups=200)
+    print(f'Checked lookups after {args.check_changes} changes to {args.check_names} names: {len(differences)} differences\n')
+
+    rows = index_rows(args.names)
+    started = time.perf_counter()
+    index = PrefixIndex(rows, keep=2 * config.TYPEAHEAD_MAX_LIMIT)
+    indexed = (time.perf_counter() - started) * 1000
+
+    lookups = []
+    for typed in TYPED:
+        for kind in (None, 'venue'):
+            timings = []
+            for n in range(args.repeat):
+                index.put('venue', 1 + n % 100, f'The Renamed Hall {n}')
+                started = time.perf_counter()
+                results = index.search(typed, args.limit, kind)
+                timings.append((time.perf_counter() - started) * 1000)
+            lookups.append((typed, kind, len(results), timings))
+    del index
+
+    # Timed once the index is gone, so its lookups don't pay for collecting
+    # the garbage of a second copy of the names
+    started = time.perf_counter()
+    sortedNames = SortedNames(rows)
+    print(f'Indexed {len(rows)} names in {indexed:.0f} ms, sorted their words in {(time.perf_counter() - started) * 1000:.0f} ms\n')
+
+    print(f'{"typed":26} {"results":>7} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8} {"sorted p50 ms":>14}')
+    failures = []
+    for typed, kind, found, timings in lookups:
+        sortedTimings = []
+        for n in range(args.baseline_repeat):
+            started = time.perf_counter()
+            sortedNames.search(typed, args.limit, kind)
+            sortedTimings.append((time.perf_counter() - started) * 1000)
+
+        label = f'{typed!r}' + (f' ({kind}s)' if kind else '')
+        p99 = percentile(timings, 99)
+        print(
+            f'{label:26} {found:7} {percentile(timings, 50):8.3f} {p99:8.3f} {max(timings):8.3f}'
+            f' {percentile(sortedTimings, 50):14.3f}'
+        )
+        if p99 > args.budget_ms:
+            failures.append(f'{label}: p99 {p99:.3f} ms, budget is {args.budget_ms} ms')
+
+    if differences:
+        print('\nUpdated index answers differently:\n  ' + '\n  '.join(differences[:20]))
+    if failures:
+        print('\nLookup budget exceeded:\n  ' + '\n  '.join(failures))
+    if differences or failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
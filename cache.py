@@ -0,0 +1,420 @@
+#----------------------------------------------------------------------------#
+# Caching.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from functools import wraps
+from importlib import import_module
+from threading import Lock
+from flask import current_app, g, request, session, make_response, has_app_context
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from replicas import read_primary_unless_replayed
+
+# Cache backends share a small interface: get(key) returning None on a miss,
+# set(key, value), delete(*keys) and clear(). Keys are strings, so the same
+# keys work for an in-process backend and a shared one.
+
+class LRUCache:
+    """In-process cache keeping the `max_entries` most recently used entries,
+    each for at most `timeout` seconds."""
+
+    def __init__(self, max_entries=1024, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """Cache shared by every worker and host, stored in Redis. Values are
+    pickled. Needs the `redis` package."""
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=300, prefix='fyyur:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.timeout)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class NullCache:
+    """Cache that never stores anything, for disabling a cache."""
+
+    def __init__(self, **options):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+def load_backend(path, options):
+    # `path` is a dotted path to a backend class, Eg: "cache.LRUCache"
+    moduleName, className = path.rsplit('.', 1)
+    backend = getattr(import_module(moduleName), className)
+    return backend(**options)
+
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+def init_page_cache(app):
+    app.extensions['page_cache'] = load_backend(
+        app.config['PAGE_CACHE_BACKEND'],
+        app.config['PAGE_CACHE_OPTIONS']
+    )
+    app.extensions['templates_digest'] = templates_digest(app)
+
+def page_cache():
+    return current_app.extensions['page_cache']
+
+def page_key(kind, entity_id):
+    return f'page:{kind}:{entity_id}'
+
+# When pages were last invalidated, a time.time()
+INVALIDATED_KEY = 'page:invalidated'
+
+def cached_page(kind, id_arg):
+    """Caches the rendered body of a detail page, keyed by the entity kind and
+    the view argument `id_arg`. Handlers changing an entity drop its page
+    with invalidate_pages(), after committing. A page missing from the cache
+    is rendered from the primary when the replica the request reads from may
+    not have replayed that commit yet.
+
+    Under conditional_page() the body is kept with the ETag it was rendered
+    for and only served for that ETag, so a page whose version changed
+    without an invalidation (Eg: a show started, counts rolled) is rendered
+    again instead of going out under the new ETag."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Pages rendered with pending flash messages would consume them,
+            # these are neither served from nor stored in the cache
+            if session.get('_flashes'):
+                return view(**kwargs)
+
+            key = page_key(kind, kwargs[id_arg])
+            etag = g.get('page_etag')
+            body = cached_for(page_cache().get(key), etag)
+            if body is not None:
+                return make_response(body)
+
+            read_primary_unless_replayed(page_cache().get(INVALIDATED_KEY))
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                page_cache().set(key, (etag, response.get_data()))
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+def cached_for(entry, etag):
+    # Value of a cached (ETag, value) entry, None unless made for `etag`
+    if entry is None or entry[0] != etag:
+        return None
+    return entry[1]
+
+def invalidate_pages(kind, *entity_ids):
+    if not entity_ids:
+        return
+    page_cache().delete(*(page_key(kind, entity_id) for entity_id in entity_ids))
+    page_cache().set(INVALIDATED_KEY, time.time())
+
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+# Pages carry a weak ETag, and a Last-Modified time when they have one,
+# computed from their version (a row from one of the *_version() queries).
+# Requests sending back a matching If-None-Match, or an If-Modified-Since no
+# older than the page, are answered 304 Not Modified before the view runs,
+# so the page is neither rendered nor are its shows loaded. Cache-Control
+# no-cache has browsers and CDNs revalidate on every visit.
+
+def templates_digest(app):
+    # Part of every ETag, so pages rendered by other templates (another
+    # release) don't match
+    digest = hashlib.sha1()
+    for name in sorted(app.jinja_loader.list_templates()):
+        digest.update(app.jinja_loader.get_source(app.jinja_env, name)[0].encode())
+    return digest.hexdigest()
+
+def page_validators(version, salt):
+    """Returns the ETag and Last-Modified time (or None) of a page."""
+    etag = hashlib.sha1(repr((salt, tuple(version))).encode()).hexdigest()
+
+    lastModified = version._mapping.get('updated_at')
+    lastStarted = version._mapping.get('last_started')
+    if lastStarted is not None:
+        # Show times are naive local times, other times are time zone aware
+        lastModified = max(lastModified, lastStarted.astimezone())
+
+    return etag, lastModified
+
+def not_modified(request, etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have no fraction of seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+
+def conditional_page(version):
+    """Answers conditional requests for the decorated view. `version` is
+    called with the view arguments and returns the page version, or None
+    when there is no page (the view then answers, Eg: with a 404)."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Flash messages are shown once, these pages aren't reused
+            if session.get('_flashes'):
+                return view(**kwargs)
+
+            pageVersion = version(**kwargs)
+            if pageVersion is None:
+                return view(**kwargs)
+
+            etag, lastModified = page_validators(pageVersion, current_app.extensions['templates_digest'])
+            if not_modified(request, etag, lastModified):
+                response = make_response('', 304)
+            else:
+                # For cached_page to serve only a body of this version
+                g.page_etag = etag
+                response = make_response(view(**kwargs))
+
+            if response.status_code in (200, 304):
+                set_validators(response, etag, lastModified)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+#----------------------------------------------------------------------------#
+# Template caches.
+#----------------------------------------------------------------------------#
+
+# Tiles repeated across pages (a venue in its area, a show with its artist or
+# venue) are rendered once and reused:
+#
+#   {% cache 'venue-show', show.artist_id, show.artist_updated_at, show.start_time %}
+#     ...
+#   {% endcache %}
+#
+# The arguments are the fragment's key, they name it and include the version
+# (updated_at) of every entity it shows, so a change renders a new fragment
+# and nothing has to be dropped; stale ones expire. The digest of the
+# templates is part of every key too. A page looks up each of its fragments,
+# keep FRAGMENT_CACHE_BACKEND in process.
+#
+# Compiled templates are written to a bytecode cache directory, so workers
+# started later load them instead of compiling every template again.
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_salt='')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render_fragment', [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, args, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key = fragment_key(self.environment.fragment_salt, args)
+        body = cache.get(key)
+        if body is not None:
+            return Markup(body)
+
+        if self.environment.is_async:
+            # caller() returns a coroutine in the asyncio app's templates
+            return self._render_fragment_async(cache, key, caller)
+
+        body = caller()
+        cache.set(key, str(body))
+        return body
+
+    async def _render_fragment_async(self, cache, key, caller):
+        body = await caller()
+        cache.set(key, str(body))
+        return body
+
+def fragment_key(salt, args):
+    return 'fragment:' + hashlib.sha1(repr((salt, *args)).encode()).hexdigest()
+
+def bytecode_cache(config, kind):
+    # Flask and the asyncio app (`kind`) compile templates differently, each
+    # has its own files
+    if not config['TEMPLATE_BYTECODE_CACHE']:
+        return None
+
+    directory = config['TEMPLATE_BYTECODE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory, f'__fyyur_{kind}_%s.cache')
+
+def configure_templates(env, fragments, salt, bytecode):
+    """Adds the template caches to a Jinja environment, the Flask app's or
+    the asyncio app's."""
+    env.add_extension(FragmentCacheExtension)
+    env.fragment_cache = fragments
+    env.fragment_salt = salt
+    env.bytecode_cache = bytecode
+
+def init_template_caches(app):
+    """Call after init_page_cache(), fragment keys include the templates
+    digest."""
+    app.extensions['fragment_cache'] = load_backend(
+        app.config['FRAGMENT_CACHE_BACKEND'],
+        app.config['FRAGMENT_CACHE_OPTIONS']
+    )
+    configure_templates(
+        app.jinja_env,
+        app.extensions['fragment_cache'],
+        app.extensions['templates_digest'],
+        bytecode_cache(app.config, 'flask')
+    )
+
+
+#----------------------------------------------------------------------------#
+# Entity cache.
+#----------------------------------------------------------------------------#
+
+# Serialised Venue and Artist dicts (toJson) are cached under the tag of their
+# entity. Models list the tags a change to a row affects in `cache_tags()`,
+# Eg: a Show affects the tags of its venue and artist. Tags of every row
+# flushed in a transaction are collected and dropped once it commits, so
+# callers never invalidate by hand. Bulk Query.update()/delete() bypass the
+# session and are only covered by the cache timeout.
+
+def init_entity_cache(app):
+    app.extensions['entity_cache'] = load_backend(
+        app.config['ENTITY_CACHE_BACKEND'],
+        app.config['ENTITY_CACHE_OPTIONS']
+    )
+
+    if not event.contains(Session, 'after_flush', collect_cache_tags):
+        event.listen(Session, 'after_flush', collect_cache_tags)
+        event.listen(Session, 'after_commit', invalidate_cache_tags)
+        event.listen(Session, 'after_rollback', discard_cache_tags)
+
+def entity_cache():
+    return current_app.extensions['entity_cache']
+
+def entity_tag(kind, entity_id):
+    return f'entity:{kind}:{entity_id}'
+
+def cached_entity(entity, build):
+    # Like cached pages, a dict built for a page under conditional_page() is
+    # only reused for the same ETag, changes the session didn't see (another
+    # worker's in-process cache, raw SQL) rebuild it with the page
+    key = entity_tag(type(entity).__name__, entity.id)
+    etag = g.get('page_etag') if has_app_context() else None
+    value = cached_for(entity_cache().get(key), etag)
+    if value is None:
+        value = build()
+        entity_cache().set(key, (etag, value))
+
+    # Callers may update the dict they get, the cached one stays intact
+    return dict(value)
+
+def collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if hasattr(obj, 'cache_tags'):
+            tags.update(obj.cache_tags())
+
+def invalidate_cache_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags and has_app_context() and 'entity_cache' in current_app.extensions:
+        entity_cache().delete(*tags)
+
+def discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
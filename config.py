@@ -1,12 +1,128 @@
 import os
-SECRET_KEY = os.urandom(32)
+# Signs the session cookie. Every worker must have the same one or they reject
+# each other's sessions (flashes, reads from the primary after a write), set
+# it in production. The random default only suits a single process.
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Enable debug mode.
 DEBUG = True
 
+# Errors are logged to this file when not debugging, empty to only log to
+# stderr (Eg: under gunicorn, which collects it)
+ERROR_LOG = os.environ.get('ERROR_LOG', 'error.log')
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
 # Connect to the database
 # DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://biswas@localhost:5432/fyyurdb' # Your database path here
-SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://biswas@localhost:5432/fyyurdb') # Your database path here
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# The asyncio app (asgi.py) uses psycopg's asyncio mode on the same database,
+# set ASYNC_DATABASE_URL for another driver, Eg: postgresql+asyncpg://...
+ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URL')
+
+# Connection pool of each worker process, see pool.py. Each worker holds up
+# to DB_POOL_SIZE + DB_MAX_OVERFLOW connections, keep workers times that
+# below the server's max_connections.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which connections are replaced, -1 keeps them forever
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Test connections on checkout, so ones dropped by the server are replaced
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+# Statements running longer than this are cancelled by the server, 0 disables
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+# Connect through PgBouncer in transaction pooling mode: PgBouncer does the
+# pooling, and neither session settings nor prepared statements are used
+DB_PGBOUNCER = env_flag('DB_PGBOUNCER', False)
+
+# Read replicas of the database, comma separated URLs. Selects of GET
+# requests run on one of them while it lags less than REPLICA_MAX_LAG
+# seconds behind, checked every REPLICA_CHECK_INTERVAL seconds. Clients
+# that just wrote read from the primary for REPLICA_STICKY_SECONDS, and so
+# do detail pages filling the page cache until the replica replayed the
+# last change dropping pages from it (see replicas.py)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = 2
+REPLICA_STICKY_SECONDS = 10
+
+# Number of shows listed per page on /shows and on the shows pages of a
+# venue/artist (/venues/<id>/shows)
+SHOWS_PER_PAGE = 30
+
+# Upcoming and past shows listed on a venue/artist detail page, the others
+# are paged on its shows page
+DETAIL_SHOWS_LIMIT = 12
+
+# Maximum number of results shown on the search pages
+SEARCH_RESULTS_LIMIT = 50
+
+# Best matching artists/venues listed on the detail pages (see matches.py),
+# and most the /api/.../matches endpoints return with ?limit=
+MATCHES_LIMIT = 20
+MATCHES_API_MAX_LIMIT = 100
+
+# Venue/artist names the typeahead (/api/typeahead, see typeahead.py)
+# returns by default and at most with ?limit=, and seconds between rebuilds
+# of its index from the database
+TYPEAHEAD_LIMIT = 8
+TYPEAHEAD_MAX_LIMIT = 20
+TYPEAHEAD_REFRESH_INTERVAL = 60
+
+# Background jobs (see jobs.py) run on JOB_WORKERS threads of every web
+# worker when JOBS_IN_APP is set. Set it to false to run them only in
+# separate workers: flask jobs work
+JOBS_IN_APP = env_flag('JOBS_IN_APP', True)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Seconds between looks for due jobs while idle, submitted jobs start at once
+# in the process submitting them
+JOB_POLL_INTERVAL = 5
+# Seconds a running job is claimed for, its runner renews the claim every
+# third of it while the job runs. A job not renewed in time is assumed lost
+# with its worker and run again.
+JOB_LEASE = 60
+# Seconds before a failed job is retried, doubled on each attempt
+JOB_RETRY_DELAY = 30
+
+# Venues/artists with more shows than this are deleted in the background,
+# DELETE_BATCH_SIZE shows per transaction (see deletes.py)
+DELETE_INLINE_MAX_SHOWS = 1000
+DELETE_BATCH_SIZE = 500
+
+# Rendered venue and artist pages are cached and dropped whenever the venue,
+# the artist or one of their shows changes. A cached page is only served for
+# the version (ETag) it was rendered for, so one whose show just started or
+# whose counts were rolled is rendered again.
+# For a cache shared between workers use 'cache.RedisCache' with
+# PAGE_CACHE_OPTIONS = {'url': 'redis://localhost:6379/0', 'timeout': 300}
+PAGE_CACHE_BACKEND = 'cache.LRUCache'
+PAGE_CACHE_OPTIONS = {'max_entries': 1024, 'timeout': 300}
+
+# Rendered tiles of venues and shows, {% cache %} blocks in the templates.
+# Their keys hold the version of what they show, they are never dropped.
+# Pages look up each tile, a shared backend would cost a round trip per tile.
+FRAGMENT_CACHE_BACKEND = 'cache.LRUCache'
+FRAGMENT_CACHE_OPTIONS = {'max_entries': 50000, 'timeout': 3600}
+
+# Compiled templates are kept on disk so new workers don't compile them
+# again, in the system's temporary directory unless a directory is set
+TEMPLATE_BYTECODE_CACHE = env_flag('TEMPLATE_BYTECODE_CACHE', True)
+TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR') or None
+
+# Serialised venues and artists (toJson) are cached and dropped automatically
+# when a transaction changing them, or one of their shows, commits
+ENTITY_CACHE_BACKEND = 'cache.LRUCache'
+ENTITY_CACHE_OPTIONS = {'max_entries': 10000, 'timeout': 300}
+
+# Per request timings (queries, database, render and date formatting time)
+# are sent as a Server-Timing header, and requests slower than the threshold
+# are logged with their slowest statements
+SERVER_TIMING_HEADER = True
+SLOW_REQUEST_THRESHOLD_MS = 500
@@ -0,0 +1,170 @@
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+import click
+from datetime import datetime
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from cache import invalidate_pages, entity_tag
+from jobs import task
+from models import db
+
+# Past and upcoming show counts of venues and artists live in the
+# VenueShowCount and ArtistShowCount summary tables (see models.py). Shows
+# starting after the watermark `counted_until` are counted as upcoming, the
+# others as past:
+#   - add_show() and remove_shows() adjust the counts in the transaction
+#     creating or deleting shows
+#   - roll() moves the shows that started since the last run from upcoming to
+#     past and advances the watermark, run it periodically:
+#       */5 * * * * flask counters roll
+#     or queue it as a background job (see jobs.py), Eg: from cron
+#       */5 * * * * flask jobs submit counters.roll
+#   - rebuild() recounts everything from the Show table
+# Rolled counts bypass the session, the cached entities and pages of the
+# venues/artists they changed are dropped once the transaction commits.
+# Writers take a share lock on the watermark and roll() an exclusive one, so
+# a show created while counts are rolled is never counted on the wrong side.
+# The watermark is a time of the app's clock, datetime.now(), which the views
+# split upcoming from past shows with, never the database's.
+
+# (table, key, kind of page, model name)
+COUNTER_TABLES = (('VenueShowCount', 'venue_id', 'venue', 'Venue'), ('ArtistShowCount', 'artist_id', 'artist', 'Artist'))
+
+ADD_SHOW = '''
+INSERT INTO "{table}" ({key}, upcoming_shows_count, past_shows_count)
+SELECT {key}, (start_time > :counted_until)::int, (start_time <= :counted_until)::int
+FROM "Show"
+WHERE id = :show_id
+ON CONFLICT ({key}) DO UPDATE SET
+    upcoming_shows_count = "{table}".upcoming_shows_count + excluded.upcoming_shows_count,
+    past_shows_count = "{table}".past_shows_count + excluded.past_shows_count
+'''
+
+# Counts of the shows matching a condition, per venue or artist
+SHOW_COUNTS = '''
+SELECT {key},
+    count(*) FILTER (WHERE start_time > :counted_until) AS upcoming,
+    count(*) FILTER (WHERE start_time <= :counted_until) AS past
+FROM "Show"
+WHERE {condition}
+GROUP BY {key}
+'''
+
+REMOVE_SHOWS = '''
+UPDATE "{table}" AS c SET
+    upcoming_shows_count = c.upcoming_shows_count - s.upcoming,
+    past_shows_count = c.past_shows_count - s.past
+FROM (''' + SHOW_COUNTS + ''') AS s
+WHERE c.{key} = s.{key}
+'''
+
+ROLL = '''
+UPDATE "{table}" AS c SET
+    upcoming_shows_count = c.upcoming_shows_count - s.started,
+    past_shows_count = c.past_shows_count + s.started
+FROM (
+    SELECT {key}, count(*) AS started
+    FROM "Show"
+    WHERE start_time > :counted_until AND start_time <= :now
+    GROUP BY {key}
+) AS s
+WHERE c.{key} = s.{key}
+RETURNING c.{key}
+'''
+
+REBUILD = '''
+INSERT INTO "{table}" ({key}, upcoming_shows_count, past_shows_count)
+''' + SHOW_COUNTS.replace('WHERE {condition}\n', '')
+
+
+def counted_until(lock):
+    return db.session.execute(db.text(
+        f'SELECT counted_until FROM "ShowCountWatermark" WHERE id = 1 FOR {lock}'
+    )).scalar()
+
+def add_show(show):
+    """Counts a new, flushed, show for its venue and artist."""
+    params = {'counted_until': counted_until('SHARE'), 'show_id': show.id}
+
+    for table, key, _, _ in COUNTER_TABLES:
+        db.session.execute(db.text(ADD_SHOW.format(table=table, key=key)), params)
+
+def remove_shows(condition, **params):
+    """Uncounts the shows matching `condition`, SQL on "Show" with the bound
+    `params` (Eg: remove_shows('venue_id = :venue_id', venue_id=1)), call it
+    before deleting them."""
+    params = {**params, 'counted_until': counted_until('SHARE')}
+
+    for table, key, _, _ in COUNTER_TABLES:
+        db.session.execute(db.text(REMOVE_SHOWS.format(table=table, key=key, condition=condition)), params)
+
+@task('counters.roll')
+def roll(now=None):
+    """Moves shows that started since the last roll from upcoming to past,
+    returns the time counts are now rolled to."""
+    params = {'counted_until': counted_until('UPDATE'), 'now': now or datetime.now()}
+    if params['now'] <= params['counted_until']:
+        return params['counted_until']
+
+    tags = db.session.info.setdefault('cache_tags', set())
+    pages = db.session.info.setdefault('rolled_pages', set())
+    for table, key, kind, modelName in COUNTER_TABLES:
+        for entityId in db.session.scalars(db.text(ROLL.format(table=table, key=key)), params):
+            tags.add(entity_tag(modelName, entityId))
+            pages.add((kind, entityId))
+
+    db.session.execute(db.text('UPDATE "ShowCountWatermark" SET counted_until = :now WHERE id = 1'), params)
+    return params['now']
+
+@task('counters.rebuild')
+def rebuild(now=None):
+    """Recounts every venue and artist from the Show table."""
+    counted_until('UPDATE')
+    params = {'counted_until': now or datetime.now()}
+
+    db.session.execute(db.text('UPDATE "ShowCountWatermark" SET counted_until = :counted_until WHERE id = 1'), params)
+    for table, key, _, _ in COUNTER_TABLES:
+        db.session.execute(db.text(f'DELETE FROM "{table}"'))
+        db.session.execute(db.text(REBUILD.format(table=table, key=key)), params)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+counters_cli = AppGroup('counters', help='Maintain the past/upcoming show counters.')
+
+@counters_cli.command('roll')
+def roll_command():
+    """Move shows that started since the last run to past."""
+    rolledTo = roll()
+    db.session.commit()
+    click.echo(f'Show counts rolled to {rolledTo}')
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Recount every venue and artist from scratch."""
+    rebuild()
+    db.session.commit()
+    click.echo('Show counts rebuilt')
+
+def invalidate_rolled_pages(session):
+    pages = session.info.pop('rolled_pages', None)
+    if not pages or not has_app_context() or 'page_cache' not in current_app.extensions:
+        return
+
+    for kind in ('venue', 'artist'):
+        invalidate_pages(kind, *(entityId for pageKind, entityId in pages if pageKind == kind))
+
+def discard_rolled_pages(session):
+    session.info.pop('rolled_pages', None)
+
+def init_counters(app):
+    app.cli.add_command(counters_cli)
+
+    if not event.contains(Session, 'after_commit', invalidate_rolled_pages):
+        event.listen(Session, 'after_commit', invalidate_rolled_pages)
+        event.listen(Session, 'after_rollback', discard_rolled_pages)
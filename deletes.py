@@ -0,0 +1,100 @@
+#----------------------------------------------------------------------------#
+# Venue and artist deletion.
+#----------------------------------------------------------------------------#
+
+from flask import current_app
+from models import db, Artist, Venue, Show
+from cache import invalidate_pages, entity_cache, entity_tag
+from jobs import task
+import counters
+
+# Shows reference their venue and artist with ON DELETE CASCADE foreign keys
+# and the relationships are passive_deletes, so deleting a venue/artist
+# doesn't load its shows: the database deletes them with the row. What the
+# shows change on the other side (the artists of a venue's shows, the venues
+# of an artist's) is adjusted with set based statements beforehand:
+#   - their show counts (see counters.py)
+#   - their update time, for the Last-Modified of their pages
+#   - their cached pages and entities, dropped once the transaction commits
+#
+# Venues/artists with more than DELETE_INLINE_MAX_SHOWS shows are deleted by
+# the "deletes.delete" job (see jobs.py): their shows go in batches of
+# DELETE_BATCH_SIZE, each in its own short transaction, then the row itself.
+# A retried job carries on from the shows left.
+
+# Model: (page kind, Show column of the model, Show column of the other
+# side, other model, other page kind)
+SIDES = {
+    Venue: ('venue', 'venue_id', 'artist_id', Artist, 'artist'),
+    Artist: ('artist', 'artist_id', 'venue_id', Venue, 'venue'),
+}
+
+def release_shows(model, condition, **params):
+    """Uncounts the shows matching `condition` (see counters.remove_shows)
+    and touches the other side of each, call it before deleting them.
+    Returns the ids of the other side."""
+    _, _, otherKey, other, _ = SIDES[model]
+    otherIds = db.session.scalars(
+        db.select(getattr(Show, otherKey)).where(db.text(condition).bindparams(**params)).distinct()
+    ).all()
+
+    if otherIds:
+        db.session.execute(
+            db.update(other).where(other.id.in_(otherIds)).values(updated_at=db.func.now()),
+            execution_options={'synchronize_session': False}
+        )
+    counters.remove_shows(condition, **params)
+    return otherIds
+
+def invalidate_shows(model, entity_id, other_ids):
+    """Drops the pages and entities the deleted shows were part of."""
+    kind, _, _, other, otherKind = SIDES[model]
+    invalidate_pages(kind, entity_id)
+    invalidate_pages(otherKind, *other_ids)
+    entity_cache().delete(*(entity_tag(other.__name__, otherId) for otherId in other_ids))
+
+def show_count(entity):
+    return entity.upcoming_shows_count + entity.past_shows_count
+
+def delete_entity(model, entity_id):
+    """Deletes a venue/artist, and its remaining shows with it. Returns
+    False when it doesn't exist."""
+    entity = db.session.get(model, entity_id)
+    if entity is None:
+        return False
+
+    key = SIDES[model][1]
+    otherIds = release_shows(model, f'"Show".{key} = :entity_id', entity_id=entity_id)
+    db.session.delete(entity)
+    db.session.commit()
+
+    invalidate_shows(model, entity_id, otherIds)
+    return True
+
+def delete_show_batch(model, entity_id, batch_size):
+    """Deletes the next `batch_size` shows of a venue/artist in a
+    transaction, returns how many were deleted."""
+    key = getattr(Show, SIDES[model][1])
+    # Locked, so a concurrent batch can't uncount the same shows
+    showIds = db.session.scalars(
+        db.select(Show.id).where(key == entity_id).order_by(Show.id).limit(batch_size).with_for_update()
+    ).all()
+    if not showIds:
+        return 0
+
+    otherIds = release_shows(model, '"Show".id = ANY(:show_ids)', show_ids=showIds)
+    db.session.execute(db.delete(Show).where(Show.id.in_(showIds)), execution_options={'synchronize_session': False})
+    db.session.commit()
+
+    invalidate_shows(model, entity_id, otherIds)
+    return len(showIds)
+
+@task('deletes.delete')
+def delete_in_batches(model_name, entity_id):
+    """Job deleting a venue/artist with many shows, Eg: ('Venue', 1)."""
+    model = next(model for model in SIDES if model.__name__ == model_name)
+    entity_id = int(entity_id)
+    batchSize = current_app.config['DELETE_BATCH_SIZE']
+    while delete_show_batch(model, entity_id, batchSize):
+        pass
+    delete_entity(model, entity_id)
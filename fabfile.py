@@ -6,9 +6,14 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
+        # Checks the per route query budgets on a small synthetic dataset,
+        # needs BENCHMARK_DATABASE_URL (see benchmarks/)
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m benchmarks.routes --venues 500 --artists 2000 --shows 20000", capture=True
         )
+        # Startup time budget and modules kept out of startup
+        if result.succeeded:
+            result = local("python -m benchmarks.import_time", capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -0,0 +1,23 @@
+# Gunicorn settings, run with:
+#   $ gunicorn
+# Every setting can be overridden on the command line, Eg: gunicorn -w 4
+
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app(warm_up=True)'
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+
+# The app is loaded and warmed up once in the master, workers are forked
+# from it and share its memory. Database connections aren't inherited, each
+# worker opens its own pool (see pool.py): keep threads at most
+# DB_POOL_SIZE + DB_MAX_OVERFLOW, and workers times that below the server's
+# max_connections.
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+# Logs go to stderr, set ERROR_LOG= to keep the app from also writing error.log
+accesslog = '-'
+errorlog = '-'
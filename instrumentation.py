@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------------#
+# Instrumentation.
+#----------------------------------------------------------------------------#
+
+import time
+from functools import wraps
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Every request records its number of queries, the time spent in the
+# database, rendering templates and formatting dates. These are sent back as
+# a Server-Timing header (shown in the browser's devtools), and requests
+# slower than SLOW_REQUEST_THRESHOLD_MS are logged along with their slowest
+# statements. Render time includes queries run from within templates.
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.statements = []
+        self.render_started = None
+        # Time spent in named sections, Eg: "render", "datetime"
+        self.sections = {}
+
+    def add_query(self, statement, duration):
+        self.queries += 1
+        self.db += duration
+        self.statements.append((duration, statement))
+
+    def add(self, section, duration):
+        self.sections[section] = self.sections.get(section, 0.0) + duration
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        metrics = [f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [f'{section};dur={duration * 1000:.1f}' for section, duration in self.sections.items()]
+        metrics.append(f'total;dur={self.total() * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def current_timings():
+    if has_request_context():
+        return g.get('request_timings')
+    return None
+
+def timed(section):
+    """Adds the time spent in the decorated function to `section` of the
+    current request's timings."""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            timings = current_timings()
+            if timings is None:
+                return function(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.add(section, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+#  Database
+#  ----------------------------------------------------------------
+
+# The start of a statement is kept in its execution context, dropped with it
+# whether the statement succeeds or fails. Failed statements (Eg: cancelled
+# by the statement timeout) count as queries too.
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_query(context, statement)
+
+def handle_error(exception_context):
+    if exception_context.execution_context is not None:
+        record_query(exception_context.execution_context, exception_context.statement)
+
+def record_query(context, statement):
+    started, context._query_started = getattr(context, '_query_started', None), None
+    timings = current_timings()
+    if started is not None and timings is not None:
+        timings.add_query(statement, time.perf_counter() - started)
+
+
+#  Templates
+#  ----------------------------------------------------------------
+
+def before_render(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None:
+        timings.render_started = time.perf_counter()
+
+def after_render(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None and timings.render_started is not None:
+        timings.add('render', time.perf_counter() - timings.render_started)
+
+
+#  Requests
+#  ----------------------------------------------------------------
+
+def init_instrumentation(app):
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+
+    before_render_template.connect(before_render, app)
+    template_rendered.connect(after_render, app)
+
+    @app.before_request
+    def start_timings():
+        g.request_timings = RequestTimings()
+
+    @app.after_request
+    def report_timings(response):
+        timings = current_timings()
+        if timings is None:
+            return response
+
+        if app.config['SERVER_TIMING_HEADER']:
+            response.headers['Server-Timing'] = timings.server_timing()
+
+        total = timings.total() * 1000
+        if total > app.config['SLOW_REQUEST_THRESHOLD_MS']:
+            log_slow_request(app, timings, total)
+
+        return response
+
+def log_slow_request(app, timings, total):
+    slowest = sorted(timings.statements, key=lambda item: item[0], reverse=True)[:10]
+    statements = '\n'.join(f'  {duration * 1000:.1f}ms {" ".join(statement.split())}' for duration, statement in slowest)
+
+    app.logger.warning(
+        f'Slow request {request.method} {request.full_path.rstrip("?")} took {total:.1f}ms '
+        f'({timings.server_timing()})\nSlowest of {timings.queries} statements:\n{statements}'
+    )
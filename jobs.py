@@ -0,0 +1,257 @@
+#----------------------------------------------------------------------------#
+# Background jobs.
+#----------------------------------------------------------------------------#
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, Job
+
+# Work too long to run in a request, Eg: deleting a venue with thousands of
+# shows, is queued as a row of the Job table (see models.py) and run by a
+# JobRunner: a thread claiming due jobs and running them on a thread pool of
+# JOB_WORKERS threads, each in an app context on its own database session.
+#   - submit() queues a job and returns its id at once, /jobs/<id> reports
+#     its state: queued, running, done or failed
+#   - jobs run the function registered under their name with @task, their
+#     arguments are JSON values
+#   - a failed job is retried JOB_RETRY_DELAY seconds later, doubling each
+#     time, until it ran `max_attempts` times
+#   - a claimed job is leased for JOB_LEASE seconds, renewed every third of
+#     it while it runs, a job of a worker that died is claimed again once
+#     its lease ends, so tasks must be safe to run twice. One whose lease
+#     ended on its last attempt (Eg: it kills its worker) is marked failed.
+# Jobs are claimed with FOR UPDATE SKIP LOCKED, any number of runners share
+# the queue. Web workers run one when JOBS_IN_APP is set, started on their
+# first request so a pre-forking server forks them before it exists; a
+# separate worker runs `flask jobs work`.
+
+# Task name: (function, max attempts)
+TASKS = {}
+
+def task(name, max_attempts=3):
+    """Registers the decorated function as the task `name`."""
+
+    def decorator(function):
+        TASKS[name] = (function, max_attempts)
+        return function
+
+    return decorator
+
+# Fails the running jobs whose lease ended on their last attempt
+EXPIRE = '''
+UPDATE "Job" SET state = 'failed', finished_at = now(), error = 'Lease expired on the last attempt'
+WHERE state = 'running' AND run_after <= now() AND attempts >= max_attempts
+'''
+
+# Takes the next due job, queued or whose lease ended with attempts left
+CLAIM = '''
+UPDATE "Job" SET
+    state = 'running',
+    attempts = attempts + 1,
+    started_at = now(),
+    run_after = now() + make_interval(secs => :lease)
+WHERE id = (
+    SELECT id FROM "Job"
+    WHERE state IN ('queued', 'running') AND run_after <= now()
+        AND (state = 'queued' OR attempts < max_attempts)
+    ORDER BY run_after, id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, name, args, attempts
+'''
+
+# Extends the lease of a job still running its claimed attempt
+RENEW = '''
+UPDATE "Job" SET run_after = now() + make_interval(secs => :lease)
+WHERE id = :id AND state = 'running' AND attempts = :attempts
+'''
+
+FINISH = '''
+UPDATE "Job" SET state = 'done', error = NULL, finished_at = now() WHERE id = :id
+'''
+
+FAIL = '''
+UPDATE "Job" SET
+    state = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+    run_after = now() + make_interval(secs => :retry_delay * 2 ^ (attempts - 1)),
+    finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE now() END,
+    error = :error
+WHERE id = :id
+'''
+
+def submit(name, *args):
+    """Queues the task `name` with `args`, commits the session and returns
+    the id of the job."""
+    _, maxAttempts = TASKS[name]
+    job = Job(name=name, args=list(args), max_attempts=maxAttempts)
+    db.session.add(job)
+    db.session.flush()
+    jobId = job.id
+    db.session.commit()
+
+    # Run at once when this process runs jobs
+    runner = current_app.extensions.get('jobs')
+    if runner is not None and runner.thread is not None:
+        runner.wakeup.set()
+    return jobId
+
+
+class JobRunner:
+
+    def __init__(self, app, workers, poll_interval, lease, retry_delay):
+        self.app = app
+        self.workers = workers
+        self.pollInterval = poll_interval
+        self.lease = lease
+        self.retryDelay = retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fyyur-job')
+        # Free threads of the pool, jobs are only claimed when one can run
+        self.slots = threading.Semaphore(workers)
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        # Id: attempt of the jobs running, their leases are renewed
+        self.running = {}
+        self.heartbeat = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Runs the claiming loop in a daemon thread, once."""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name='fyyur-jobs', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def work(self):
+        """Claims and runs jobs until stopped."""
+        self.heartbeat = threading.Thread(target=self.renew_leases, name='fyyur-jobs-heartbeat', daemon=True)
+        self.heartbeat.start()
+        while not self.stopping.is_set():
+            self.slots.acquire()
+            job = self.claim()
+            if job is None:
+                self.slots.release()
+                self.wakeup.wait(self.pollInterval)
+                self.wakeup.clear()
+                continue
+            with self.lock:
+                self.running[job.id] = job.attempts
+            self.executor.submit(self.run, job)
+
+        self.executor.shutdown(wait=True)
+
+    def renew_leases(self):
+        # While the claiming loop waits for a free thread, the jobs taking
+        # them keep their leases
+        while not self.stopping.wait(self.lease / 3):
+            with self.lock:
+                running = list(self.running.items())
+            if not running:
+                continue
+            with self.app.app_context():
+                try:
+                    db.session.execute(db.text(RENEW), [
+                        {'id': jobId, 'attempts': attempts, 'lease': self.lease}
+                        for jobId, attempts in running
+                    ])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Renewing the leases of jobs failed')
+                finally:
+                    db.session.remove()
+
+    def claim(self):
+        with self.app.app_context():
+            try:
+                db.session.execute(db.text(EXPIRE))
+                job = db.session.execute(db.text(CLAIM), {'lease': self.lease}).first()
+                db.session.commit()
+                return job
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Claiming a job failed')
+                return None
+            finally:
+                db.session.remove()
+
+    def run(self, job):
+        with self.app.app_context():
+            try:
+                function, _ = TASKS[job.name]
+                function(*job.args)
+                # Done in the transaction of the last changes of the task
+                db.session.execute(db.text(FINISH), {'id': job.id})
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                self.app.logger.exception('Job %s (%s) failed, attempt %s', job.id, job.name, job.attempts)
+                self.fail(job, error)
+            finally:
+                db.session.remove()
+                with self.lock:
+                    self.running.pop(job.id, None)
+                self.slots.release()
+                # The freed thread may take a job right away
+                self.wakeup.set()
+
+    def fail(self, job, error):
+        try:
+            db.session.execute(db.text(FAIL), {'id': job.id, 'retry_delay': self.retryDelay, 'error': repr(error)})
+            db.session.commit()
+        except Exception:
+            # The job is claimed again once its lease ends
+            db.session.rollback()
+            self.app.logger.exception('Recording the failure of job %s failed', job.id)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+jobs_cli = AppGroup('jobs', help='Run and queue background jobs.')
+
+@jobs_cli.command('work')
+def work_command():
+    """Run jobs until interrupted."""
+    runner = current_app.extensions['jobs']
+    click.echo(f'Running jobs with {runner.workers} threads, Ctrl+C to stop')
+    try:
+        runner.work()
+    except KeyboardInterrupt:
+        click.echo('Stopping, waiting for running jobs')
+        runner.stop()
+        runner.executor.shutdown(wait=True)
+
+@jobs_cli.command('submit')
+@click.argument('name')
+@click.argument('args', nargs=-1)
+def submit_command(name, args):
+    """Queue the task NAME, Eg: flask jobs submit counters.roll"""
+    if name not in TASKS:
+        raise click.BadParameter(f'unknown task, one of: {", ".join(sorted(TASKS))}', param_hint='NAME')
+    click.echo(f'Queued job {submit(name, *args)}')
+
+def start_runner():
+    current_app.extensions['jobs'].start()
+
+def init_jobs(app):
+    app.cli.add_command(jobs_cli)
+    app.extensions['jobs'] = JobRunner(
+        app,
+        app.config['JOB_WORKERS'],
+        app.config['JOB_POLL_INTERVAL'],
+        app.config['JOB_LEASE'],
+        app.config['JOB_RETRY_DELAY']
+    )
+    if app.config['JOBS_IN_APP']:
+        app.before_request(start_runner)
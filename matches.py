@@ -0,0 +1,155 @@
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+import click
+from flask import has_app_context, current_app
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist
+from cache import invalidate_pages
+from jobs import task
+
+# Venues seeking talent are matched with artists seeking venues in the same
+# state that share at least one genre. A match scores GENRE_POINTS per shared
+# genre, plus CITY_POINTS when both are in the same city. Matches live in the
+# Match table (see models.py), so the best matches of a venue or artist are
+# an indexed lookup instead of a scan of both tables:
+#   - when a flush creates a venue/artist, or changes a field its matches
+#     depend on (see MATCHED), they are recomputed in the same transaction
+#     with a lookup on the genres and (state, city) indexes of the other table
+#   - deleted venues/artists lose their matches through ON DELETE CASCADE
+#   - rebuild() recomputes every match: flask matches rebuild, or the
+#     matches.rebuild job (see jobs.py)
+# Detail pages listing a changed match are dropped from the page cache once
+# the transaction commits.
+
+GENRE_POINTS = 10
+CITY_POINTS = 5
+
+# Matches of the venues (v) and artists (a) passing {condition}
+MATCHES = '''
+SELECT v.id AS venue_id, a.id AS artist_id,
+    cardinality(s.genres) * :genre_points
+        + CASE WHEN a.city = v.city THEN :city_points ELSE 0 END AS score,
+    s.genres
+FROM "Venue" AS v
+JOIN "Artist" AS a ON a.state = v.state AND a.genres && v.genres
+CROSS JOIN LATERAL (
+    SELECT ARRAY(SELECT unnest(v.genres) INTERSECT SELECT unnest(a.genres) ORDER BY 1) AS genres
+) AS s
+WHERE v.seeking_talent AND a.seeking_venue AND {condition}
+'''
+
+INSERT_MATCHES = '''
+INSERT INTO "Match" (venue_id, artist_id, score, genres)
+''' + MATCHES + '''
+ON CONFLICT (venue_id, artist_id) DO NOTHING
+RETURNING venue_id, artist_id
+'''
+
+DELETE_MATCHES = '''
+DELETE FROM "Match" WHERE {key} = :entity_id RETURNING venue_id, artist_id
+'''
+
+SELECT_MATCHES = '''
+SELECT venue_id, artist_id FROM "Match" WHERE {key} = :entity_id
+'''
+
+# Model: (Match column, alias in MATCHES, fields matches depend on)
+MATCHED = {
+    Venue: ('venue_id', 'v', ('seeking_talent', 'genres', 'city', 'state')),
+    Artist: ('artist_id', 'a', ('seeking_venue', 'genres', 'city', 'state')),
+}
+
+def params(**extra):
+    return {'genre_points': GENRE_POINTS, 'city_points': CITY_POINTS, **extra}
+
+def matched_pages(rows):
+    # Detail pages showing the matches in `rows`
+    pages = set()
+    for venueId, artistId in rows:
+        pages.update((('venue', venueId), ('artist', artistId)))
+    return pages
+
+def refresh(connection, model, entity_id, new=False):
+    """Recomputes the matches of a venue or artist, returns the detail pages
+    of every match it lost or gained. A `new` one has none to remove. A pair
+    created in one flush is inserted by whichever of the two comes first."""
+    key, alias, _ = MATCHED[model]
+    removed = []
+    if not new:
+        removed = connection.execute(db.text(DELETE_MATCHES.format(key=key)), {'entity_id': entity_id}).all()
+    added = connection.execute(
+        db.text(INSERT_MATCHES.format(condition=f'{alias}.id = :entity_id')),
+        params(entity_id=entity_id)
+    ).all()
+    return matched_pages(removed + added)
+
+@task('matches.rebuild')
+def rebuild():
+    """Recomputes every match."""
+    db.session.execute(db.text('DELETE FROM "Match"'))
+    db.session.execute(db.text(INSERT_MATCHES.format(condition='true')), params())
+
+
+#  Session hooks
+#  ----------------------------------------------------------------
+
+def fields_changed(obj, fields):
+    state = db.inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+def collect_deleted_matches(session, flush_context, instances):
+    # The cascade removes the matches of deleted rows, the pages listing them
+    # are looked up while they still exist
+    pages = session.info.setdefault('match_pages', set())
+    for obj in session.deleted:
+        if type(obj) in MATCHED and obj.id is not None:
+            key = MATCHED[type(obj)][0]
+            rows = session.connection().execute(db.text(SELECT_MATCHES.format(key=key)), {'entity_id': obj.id})
+            pages.update(matched_pages(rows))
+
+def refresh_changed_matches(session, flush_context):
+    pages = session.info.setdefault('match_pages', set())
+    for obj in (*session.new, *session.dirty):
+        if type(obj) not in MATCHED or obj in session.deleted:
+            continue
+        new = obj in session.new
+        if new or fields_changed(obj, MATCHED[type(obj)][2]):
+            pages.update(refresh(session.connection(), type(obj), obj.id, new))
+
+def invalidate_matched_pages(session):
+    pages = session.info.pop('match_pages', None)
+    if not pages or not has_app_context() or 'page_cache' not in current_app.extensions:
+        return
+
+    for kind in ('venue', 'artist'):
+        invalidate_pages(kind, *(entityId for pageKind, entityId in pages if pageKind == kind))
+
+def discard_matched_pages(session):
+    session.info.pop('match_pages', None)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+matches_cli = AppGroup('matches', help='Maintain the venue and artist matches.')
+
+@matches_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every match from scratch."""
+    rebuild()
+    db.session.commit()
+    count = db.session.execute(db.text('SELECT count(*) FROM "Match"')).scalar()
+    click.echo(f'{count} matches rebuilt')
+
+def init_matches(app):
+    app.cli.add_command(matches_cli)
+
+    if not event.contains(Session, 'after_flush', refresh_changed_matches):
+        event.listen(Session, 'before_flush', collect_deleted_matches)
+        event.listen(Session, 'after_flush', refresh_changed_matches)
+        event.listen(Session, 'after_commit', invalidate_matched_pages)
+        event.listen(Session, 'after_rollback', discard_matched_pages)
@@ -0,0 +1,60 @@
+"""10. Summary tables for past and upcoming show counts
+
+Revision ID: 0306700c5ba0
+Revises: 90ec59d817bd
+Create Date: 2026-10-18 13:40:05.918262
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0306700c5ba0'
+down_revision = '90ec59d817bd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ShowCountWatermark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('counted_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('VenueShowCount',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('upcoming_shows_count', sa.Integer(), nullable=False),
+    sa.Column('past_shows_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id')
+    )
+    op.create_table('ArtistShowCount',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('upcoming_shows_count', sa.Integer(), nullable=False),
+    sa.Column('past_shows_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id')
+    )
+
+    # Counting the existing shows, as `flask counters rebuild` does, up to the
+    # app's clock rather than the database's, which may be in another time zone
+    op.execute(sa.text(
+        'INSERT INTO "ShowCountWatermark" (id, counted_until) VALUES (1, :now)'
+    ).bindparams(now=datetime.now()))
+    for table, key in (('VenueShowCount', 'venue_id'), ('ArtistShowCount', 'artist_id')):
+        op.execute(f'''
+            INSERT INTO "{table}" ({key}, upcoming_shows_count, past_shows_count)
+            SELECT {key},
+                count(*) FILTER (WHERE start_time > w.counted_until),
+                count(*) FILTER (WHERE start_time <= w.counted_until)
+            FROM "Show", "ShowCountWatermark" AS w
+            GROUP BY {key}
+        ''')
+
+
+def downgrade():
+    op.drop_table('ArtistShowCount')
+    op.drop_table('VenueShowCount')
+    op.drop_table('ShowCountWatermark')
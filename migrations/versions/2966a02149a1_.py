@@ -0,0 +1,61 @@
+"""08. Full-text and trigram search on Venue and Artist
+
+Revision ID: 2966a02149a1
+Revises: 11e9f5bd15c9
+Create Date: 2026-10-18 10:12:44.120371
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '2966a02149a1'
+down_revision = '11e9f5bd15c9'
+branch_labels = None
+depends_on = None
+
+
+# Keeps search_vector in sync with name, genres, city and state on every
+# insert and update. Both tables have these columns, so they share it.
+SEARCH_VECTOR_FUNCTION = '''
+CREATE OR REPLACE FUNCTION search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'C');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(SEARCH_VECTOR_FUNCTION)
+
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(f'''
+            CREATE TRIGGER "{table}_search_vector_update"
+            BEFORE INSERT OR UPDATE OF name, genres, city, state ON "{table}"
+            FOR EACH ROW EXECUTE PROCEDURE search_vector_update()
+        ''')
+        # Backfilling existing rows through the trigger
+        op.execute(f'UPDATE "{table}" SET name = name')
+
+        op.create_index(f'ix_{table.lower()}_search_vector', table, ['search_vector'], unique=False, postgresql_using='gin')
+        op.create_index(f'ix_{table.lower()}_name_trgm', table, ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index(f'ix_{table.lower()}_name_trgm', table_name=table)
+        op.drop_index(f'ix_{table.lower()}_search_vector', table_name=table)
+        op.execute(f'DROP TRIGGER IF EXISTS "{table}_search_vector_update" ON "{table}"')
+        op.drop_column(table, 'search_vector')
+
+    op.execute('DROP FUNCTION IF EXISTS search_vector_update()')
+    # pg_trgm is left installed, other database objects may depend on it
@@ -0,0 +1,40 @@
+"""16. Background jobs
+
+Revision ID: 3f6b2d8e9a15
+Revises: a5d08e3c71f4
+Create Date: 2026-10-18 23:54:21.380517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2d8e9a15'
+down_revision = 'a5d08e3c71f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('args', postgresql.JSONB(astext_type=sa.Text()), server_default='[]', nullable=False),
+    sa.Column('state', sa.String(length=20), server_default='queued', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('max_attempts', sa.Integer(), server_default='3', nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('run_after', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_run_after', 'Job', ['run_after', 'id'], unique=False, postgresql_where=sa.text("state IN ('queued', 'running')"))
+
+
+def downgrade():
+    op.drop_index('ix_job_run_after', table_name='Job', postgresql_where=sa.text("state IN ('queued', 'running')"))
+    op.drop_table('Job')
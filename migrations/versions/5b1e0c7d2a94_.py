@@ -0,0 +1,37 @@
+"""11. Last update time of venues, artists and shows
+
+Revision ID: 5b1e0c7d2a94
+Revises: 0306700c5ba0
+Create Date: 2026-10-18 15:12:41.207316
+
+updated_at defaults to now(), which PostgreSQL stores as the default of
+existing rows without rewriting the tables. Existing rows get the time of
+the migration. The index on Artist.updated_at is built concurrently like
+revision 09.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c7d2a94'
+down_revision = '0306700c5ba0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_artist_updated_at', 'Artist', ['updated_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artist_updated_at', table_name='Artist', postgresql_concurrently=True)
+
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_column(table, 'updated_at')
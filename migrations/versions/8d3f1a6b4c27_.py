@@ -0,0 +1,35 @@
+"""12. Genre and area filter indexes
+
+Revision ID: 8d3f1a6b4c27
+Revises: 5b1e0c7d2a94
+Create Date: 2026-10-18 21:05:12.481903
+
+GIN indexes on the genres arrays serve the @> (every genre) and && (any
+genre) filters of the listings and searches, and the artists get the
+(state, city) index venues already have. Built concurrently like revision
+09.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f1a6b4c27'
+down_revision = '5b1e0c7d2a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+        op.create_index('ix_artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+        op.create_index('ix_artist_state_city', 'Artist', ['state', 'city'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artist_state_city', table_name='Artist', postgresql_concurrently=True)
+        op.drop_index('ix_artist_genres', table_name='Artist', postgresql_using='gin', postgresql_concurrently=True)
+        op.drop_index('ix_venue_genres', table_name='Venue', postgresql_using='gin', postgresql_concurrently=True)
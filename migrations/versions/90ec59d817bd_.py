@@ -0,0 +1,51 @@
+"""09. Indexes for Show lookups and Venue areas
+
+Revision ID: 90ec59d817bd
+Revises: 2966a02149a1
+Create Date: 2026-10-18 11:02:17.553820
+
+Indexes are built with CREATE INDEX CONCURRENTLY, so this revision can be
+applied to a live database without blocking writes to Show or Venue.
+
+Plans before and after, seen with EXPLAIN ANALYZE of each query on the
+benchmark dataset (python -m benchmarks.routes --venues 10000 --artists 50000
+--shows 1000000, see benchmarks/seed.py):
+
+Upcoming shows count of one venue (detail pages, counts)
+  before: Parallel Seq Scan on "Show"
+  after:  Bitmap Index Scan on ix_show_venue_id_start_time
+
+One page of /shows (ORDER BY start_time, id LIMIT 31 after a cursor)
+  before: Parallel Seq Scan on "Show" -> Hash Joins -> top-N heapsort
+  after:  Index Scan using ix_show_start_time_id on "Show" -> Nested Loops
+
+Venues of one area (city, state)
+  before: Seq Scan on "Venue"
+  after:  Index Scan using ix_venue_state_city on "Venue"
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90ec59d817bd'
+down_revision = '2966a02149a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_show_start_time_id', 'Show', ['start_time', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_venue_state_city', 'Venue', ['state', 'city'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_venue_state_city', table_name='Venue', postgresql_concurrently=True)
+        op.drop_index('ix_show_start_time_id', table_name='Show', postgresql_concurrently=True)
+        op.drop_index('ix_show_artist_id_start_time', table_name='Show', postgresql_concurrently=True)
+        op.drop_index('ix_show_venue_id_start_time', table_name='Show', postgresql_concurrently=True)
@@ -0,0 +1,45 @@
+"""15. Cascade deletes of shows
+
+Revision ID: a5d08e3c71f4
+Revises: e7a2c95f3b18
+Create Date: 2026-10-18 23:12:44.907215
+
+Deleting a venue or artist deletes its shows in the database, the ORM no
+longer loads them to delete them one by one (see deletes.py).
+
+The foreign keys are replaced NOT VALID, which doesn't read "Show", then
+validated in their own transactions, which read it without blocking writes.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d08e3c71f4'
+down_revision = 'e7a2c95f3b18'
+branch_labels = None
+depends_on = None
+
+
+def replace_foreign_key(column, table, ondelete):
+    name = f'Show_{column}_fkey'
+    op.drop_constraint(name, 'Show', type_='foreignkey')
+    op.create_foreign_key(name, 'Show', table, [column], ['id'], ondelete=ondelete, postgresql_not_valid=True)
+
+
+def validate_foreign_keys():
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE "Show" VALIDATE CONSTRAINT "Show_venue_id_fkey"')
+        op.execute('ALTER TABLE "Show" VALIDATE CONSTRAINT "Show_artist_id_fkey"')
+
+
+def upgrade():
+    replace_foreign_key('venue_id', 'Venue', 'CASCADE')
+    replace_foreign_key('artist_id', 'Artist', 'CASCADE')
+    validate_foreign_keys()
+
+
+def downgrade():
+    replace_foreign_key('artist_id', 'Artist', None)
+    replace_foreign_key('venue_id', 'Venue', None)
+    validate_foreign_keys()
@@ -0,0 +1,53 @@
+"""13. Venue and artist matches
+
+Revision ID: c41e7b9a0d53
+Revises: 8d3f1a6b4c27
+Create Date: 2026-10-18 21:48:30.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7b9a0d53'
+down_revision = '8d3f1a6b4c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Match',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('genres', postgresql.ARRAY(sa.String()), nullable=False),
+    sa.Column('matched_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'artist_id')
+    )
+    op.create_index('ix_match_venue_id_score', 'Match', ['venue_id', sa.text('score DESC'), 'artist_id'], unique=False)
+    op.create_index('ix_match_artist_id_score', 'Match', ['artist_id', sa.text('score DESC'), 'venue_id'], unique=False)
+
+    # Matching the existing venues and artists, as `flask matches rebuild`
+    # does (see matches.py for the scores)
+    op.execute('''
+        INSERT INTO "Match" (venue_id, artist_id, score, genres)
+        SELECT v.id, a.id,
+            cardinality(s.genres) * 10 + CASE WHEN a.city = v.city THEN 5 ELSE 0 END,
+            s.genres
+        FROM "Venue" AS v
+        JOIN "Artist" AS a ON a.state = v.state AND a.genres && v.genres
+        CROSS JOIN LATERAL (
+            SELECT ARRAY(SELECT unnest(v.genres) INTERSECT SELECT unnest(a.genres) ORDER BY 1) AS genres
+        ) AS s
+        WHERE v.seeking_talent AND a.seeking_venue
+    ''')
+
+
+def downgrade():
+    op.drop_index('ix_match_artist_id_score', table_name='Match')
+    op.drop_index('ix_match_venue_id_score', table_name='Match')
+    op.drop_table('Match')
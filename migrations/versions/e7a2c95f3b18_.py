@@ -0,0 +1,38 @@
+"""14. Show history indexes
+
+Revision ID: e7a2c95f3b18
+Revises: c41e7b9a0d53
+Create Date: 2026-10-18 22:31:07.215634
+
+Detail pages list a page of the upcoming and past shows of a venue/artist,
+ordered by (start_time, id) to page through the rest with keyset cursors.
+The id ends the (venue_id/artist_id, start_time) indexes so every page is
+read off them in order, without sorting shows starting at the same time. Built concurrently like
+revision 09, the old indexes are dropped once the new ones exist.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c95f3b18'
+down_revision = 'c41e7b9a0d53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_venue_id_start_time_id', 'Show', ['venue_id', 'start_time', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_show_artist_id_start_time_id', 'Show', ['artist_id', 'start_time', 'id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_show_venue_id_start_time', table_name='Show', postgresql_concurrently=True)
+        op.drop_index('ix_show_artist_id_start_time', table_name='Show', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_show_artist_id_start_time_id', table_name='Show', postgresql_concurrently=True)
+        op.drop_index('ix_show_venue_id_start_time_id', table_name='Show', postgresql_concurrently=True)
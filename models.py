@@ -3,12 +3,21 @@
 #----------------------------------------------------------------------------#
 
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
+from cache import cached_entity, entity_tag
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+# Selects of read-only requests may run on a read replica, see replicas.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_venue_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venue_state_city', 'state', 'city'),
+        db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -20,43 +29,40 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120))
 
     # Missing columns
-    genres = db.Column(db.ARRAY(db.String))
+    # PostgreSQL's ARRAY, for the containment and overlap operators of genre
+    # filters (GIN indexed)
+    genres = db.Column(ARRAY(db.String))
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
 
+    # Full-text search document, kept up to date by a database trigger
+    search_vector = db.deferred(db.Column(TSVECTOR, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue()))
+
+    # Time of the last change, for the ETag and Last-Modified of pages
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
     # Relationships
-    shows = db.relationship('Show', backref='venue', lazy=True, collection_class = list, cascade="save-update, delete")
+    # Shows are deleted by the database with their venue (ON DELETE CASCADE),
+    # without being loaded, see deletes.py
+    shows = db.relationship('Show', backref='venue', lazy=True, collection_class = list, cascade="save-update, delete", passive_deletes=True)
 
     # String Abstraction
     def __repr__(self):
         return f'<Venue {self.id} - {self.name}>'
 
-    # Utility methods
-    def past_shows_count(self):
-        count = 0
-        presentDateTime = datetime.now()
-
-        for show in self.shows:
-            if show.start_time < presentDateTime:
-                count += 1
-        
-        return count
-
+    # Show counts (past_shows_count, upcoming_shows_count) are column
+    # properties defined below the Show model
 
-    def upcoming_shows_count(self):
-        count = 0
-        presentDateTime = datetime.now()
+    # Cache Abstraction, tags of cached data depending on this venue
+    def cache_tags(self):
+        return [entity_tag('Venue', self.id)]
 
-        for show in self.shows:
-            if show.start_time > presentDateTime:
-                count += 1
-        
-        return count
-
-
-    # JSON Abstraction
+    # JSON Abstraction, cached until the venue or one of its shows changes
     def toJson(self):
+        return cached_entity(self, self.buildJson)
+
+    def buildJson(self):
         return {
             "id": self.id,
             "name": self.name,
@@ -70,20 +76,29 @@ class Venue(db.Model):
             "seeking_talent": self.seeking_talent,
             "seeking_description": self.seeking_description,
             "image_link": self.image_link,
-            "past_shows_count": self.past_shows_count(),
-            "upcoming_shows_count": self.upcoming_shows_count(),
+            "past_shows_count": self.past_shows_count,
+            "upcoming_shows_count": self.upcoming_shows_count,
         }
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artist_updated_at', 'updated_at'),
+        db.Index('ix_artist_state_city', 'state', 'city'),
+        db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String))
+    # PostgreSQL's ARRAY, for the containment and overlap operators of genre
+    # filters (GIN indexed)
+    genres = db.Column(ARRAY(db.String))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
 
@@ -92,37 +107,33 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
 
+    # Full-text search document, kept up to date by a database trigger
+    search_vector = db.deferred(db.Column(TSVECTOR, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue()))
+
+    # Time of the last change, for the ETag and Last-Modified of pages
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
     # Relationships
-    shows = db.relationship('Show', backref='artist', lazy=True, collection_class = list, cascade="save-update, delete")
+    # Shows are deleted by the database with their artist (ON DELETE CASCADE),
+    # without being loaded, see deletes.py
+    shows = db.relationship('Show', backref='artist', lazy=True, collection_class = list, cascade="save-update, delete", passive_deletes=True)
 
     # String Abstraction
     def __repr__(self):
         return f'<Artist {self.id} - {self.name}>'
 
-    # Utility methods
-    def past_shows_count(self):
-        count = 0
-        presentDateTime = datetime.now()
-
-        for show in self.shows:
-            if show.start_time < presentDateTime:
-                count += 1
-        
-        return count
-
+    # Show counts (past_shows_count, upcoming_shows_count) are column
+    # properties defined below the Show model
 
-    def upcoming_shows_count(self):
-        count = 0
-        presentDateTime = datetime.now()
+    # Cache Abstraction, tags of cached data depending on this artist
+    def cache_tags(self):
+        return [entity_tag('Artist', self.id)]
 
-        for show in self.shows:
-            if show.start_time > presentDateTime:
-                count += 1
-        
-        return count
-
-     # JSON Abstraction
+    # JSON Abstraction, cached until the artist or one of its shows changes
     def toJson(self):
+        return cached_entity(self, self.buildJson)
+
+    def buildJson(self):
         return {
             "id": self.id,
             "name": self.name,
@@ -135,18 +146,164 @@ class Artist(db.Model):
             "seeking_venue": self.seeking_venue,
             "seeking_description": self.seeking_description,
             "image_link": self.image_link,
-            "past_shows_count": self.past_shows_count(),
-            "upcoming_shows_count": self.upcoming_shows_count(),
+            "past_shows_count": self.past_shows_count,
+            "upcoming_shows_count": self.upcoming_shows_count,
         }
 
 class Show(db.Model):
     __tablename__= 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time_id', 'venue_id', 'start_time', 'id'),
+        db.Index('ix_show_artist_id_start_time_id', 'artist_id', 'start_time', 'id'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
 
+    # Time of the last change, for the ETag and Last-Modified of pages
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
     # String Abstraction
     def __repr__(self):
-        return f'<Show {self.id} - Artist {self.artist_id}, Venue {self.venue_id}>'
\ No newline at end of file
+        return f'<Show {self.id} - Artist {self.artist_id}, Venue {self.venue_id}>'
+
+    # Cache Abstraction, a show changes the counts of its venue and artist,
+    # including the ones it was moved away from
+    def cache_tags(self):
+        state = db.inspect(self)
+        venueIds = {self.venue_id, *state.attrs.venue_id.history.deleted}
+        artistIds = {self.artist_id, *state.attrs.artist_id.history.deleted}
+
+        return [entity_tag('Venue', venueId) for venueId in venueIds] + \
+            [entity_tag('Artist', artistId) for artistId in artistIds]
+
+
+#----------------------------------------------------------------------------#
+# Show counts.
+#----------------------------------------------------------------------------#
+
+# Past and upcoming show counts are kept per venue and per artist in summary
+# tables, updated as shows are created and deleted and rolled forward as
+# time passes (see counters.py). A show is upcoming while it starts after
+# `ShowCountWatermark.counted_until`, the time counts were last rolled to.
+
+class VenueShowCount(db.Model):
+    __tablename__ = 'VenueShowCount'
+
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArtistShowCount(db.Model):
+    __tablename__ = 'ArtistShowCount'
+
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ShowCountWatermark(db.Model):
+    __tablename__ = 'ShowCountWatermark'
+
+    # Single row table
+    id = db.Column(db.Integer, primary_key=True)
+    counted_until = db.Column(db.DateTime, nullable=False)
+
+
+# The counts are exposed on Venue and Artist as deferred column properties,
+# an indexed lookup into the summary table. Accessing either one on an
+# instance loads both in one query, and listings can load them for many rows
+# at once with `.options(db.undefer_group('show_counts'))`.
+
+def show_count_property(count_column, foreign_key, parent_id):
+    return db.column_property(
+        db.func.coalesce(
+            db.select(count_column).where(foreign_key == parent_id).scalar_subquery(),
+            0
+        ),
+        deferred=True,
+        group='show_counts'
+    )
+
+Venue.past_shows_count = show_count_property(VenueShowCount.past_shows_count, VenueShowCount.venue_id, Venue.id)
+Venue.upcoming_shows_count = show_count_property(VenueShowCount.upcoming_shows_count, VenueShowCount.venue_id, Venue.id)
+Artist.past_shows_count = show_count_property(ArtistShowCount.past_shows_count, ArtistShowCount.artist_id, Artist.id)
+Artist.upcoming_shows_count = show_count_property(ArtistShowCount.upcoming_shows_count, ArtistShowCount.artist_id, Artist.id)
+
+
+#----------------------------------------------------------------------------#
+# Matches.
+#----------------------------------------------------------------------------#
+
+# Venues seeking talent and artists seeking venues in the same state, with at
+# least one genre in common, are matched ahead of time (see matches.py). The
+# indexes on (venue_id, score) and (artist_id, score) make the best matches
+# of a venue or artist a range scan.
+
+class Match(db.Model):
+    __tablename__ = 'Match'
+    __table_args__ = (
+        db.Index('ix_match_venue_id_score', 'venue_id', db.text('score DESC'), 'artist_id'),
+        db.Index('ix_match_artist_id_score', 'artist_id', db.text('score DESC'), 'venue_id'),
+    )
+
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+    # Genres the venue and the artist have in common
+    genres = db.Column(ARRAY(db.String), nullable=False)
+    # Time the match was computed, matches are replaced rather than updated
+    matched_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+# Background jobs are rows, so they survive restarts and any worker can run
+# them (see jobs.py). `run_after` is when a queued job may start, or retry,
+# and when the lease of a running one ends. The partial index keeps claiming
+# the next job a range scan however many finished ones pile up.
+
+class Job(db.Model):
+    __tablename__ = 'Job'
+    __table_args__ = (
+        db.Index('ix_job_run_after', 'run_after', 'id', postgresql_where=db.text("state IN ('queued', 'running')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Registered task and its JSON arguments
+    name = db.Column(db.String(120), nullable=False)
+    args = db.Column(JSONB, nullable=False, server_default='[]')
+    # queued, running, done or failed
+    state = db.Column(db.String(20), nullable=False, server_default='queued')
+    attempts = db.Column(db.Integer, nullable=False, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, server_default='3')
+    # Last error, kept while the job is retried
+    error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    # String Abstraction
+    def __repr__(self):
+        return f'<Job {self.id} - {self.name} {self.state}>'
+
+    # JSON Abstraction
+    def toJson(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,157 @@
+#----------------------------------------------------------------------------#
+# Connection pool.
+#----------------------------------------------------------------------------#
+
+import os
+import time
+from threading import Lock
+from weakref import WeakSet
+from flask import current_app, has_app_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool, NullPool
+from instrumentation import current_timings
+
+# The engine is configured from the DB_* settings of config.py. Each worker
+# process has its own pool; how long requests wait for a connection (opening
+# it included) and how many are in use are recorded, added to the request's
+# Server-Timing ("pool") and served by /metrics/pool. Waits growing while
+# saturation stays at 1 mean workers need more connections, or fewer threads.
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        self.max_checked_out = 0
+        self._lock = Lock()
+
+    def add_checkout(self, wait, checked_out):
+        with self._lock:
+            self.checkouts += 1
+            self.wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.max_checked_out = max(self.max_checked_out, checked_out)
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.add_timeout()
+            raise
+
+        wait = time.perf_counter() - started
+        self.stats.add_checkout(wait, self.checkedout())
+        timings = current_timings()
+        if timings is not None:
+            timings.add('pool', wait)
+
+        return connection
+
+
+def engine_options(config):
+    uri = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    connectArgs = dict(options.get('connect_args', {}))
+
+    if config['DB_PGBOUNCER']:
+        # PgBouncer pools server connections, the app opens one per checkout.
+        # Startup parameters and prepared statements don't survive a
+        # connection moving to another server connection between transactions.
+        options['poolclass'] = NullPool
+        if uri.get_dialect().driver == 'psycopg':
+            connectArgs['prepare_threshold'] = None
+    else:
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+        )
+        if timeout:
+            connectArgs['options'] = f'-c statement_timeout={timeout}'
+
+    options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+    if connectArgs:
+        options['connect_args'] = connectArgs
+
+    return options
+
+def set_local_statement_timeout(conn):
+    # Behind PgBouncer the timeout is set for each transaction instead of
+    # the connection
+    if not has_app_context() or not current_app.config['DB_PGBOUNCER']:
+        return
+
+    timeout = current_app.config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout:
+        conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+def init_pool(app):
+    """Sets the engine options from the config, call before db.init_app()."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+    if not event.contains(Engine, 'begin', set_local_statement_timeout):
+        event.listen(Engine, 'begin', set_local_statement_timeout)
+
+# Engines of the apps built in this process, disposed in forked children by
+# a hook registered once. Weak, so it doesn't keep the engines of dropped apps.
+FORKED_ENGINES = WeakSet()
+
+def dispose_after_fork(app, db):
+    """Drops the connections a forked worker inherits from its parent, which
+    keeps using them, so each worker opens its own."""
+    with app.app_context():
+        FORKED_ENGINES.update(db.engines.values())
+
+def dispose_forked_engines():
+    for engine in list(FORKED_ENGINES):
+        engine.dispose(close=False)
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.stats = PoolStats()
+
+os.register_at_fork(after_in_child=dispose_forked_engines)
+
+
+def pool_metrics(pool):
+    metrics = {'pool': type(pool).__name__}
+    if not isinstance(pool, TimedQueuePool):
+        return metrics
+
+    stats = pool.stats
+    capacity = pool.size() + pool._max_overflow
+    metrics.update(
+        size=pool.size(),
+        max_overflow=pool._max_overflow,
+        checked_out=pool.checkedout(),
+        idle=pool.checkedin(),
+        saturation=round(pool.checkedout() / capacity, 3) if capacity > 0 else None,
+        max_checked_out=stats.max_checked_out,
+        checkouts=stats.checkouts,
+        timeouts=stats.timeouts,
+        wait_ms_total=round(stats.wait * 1000, 3),
+        wait_ms_avg=round(stats.wait * 1000 / stats.checkouts, 3) if stats.checkouts else 0.0,
+        wait_ms_max=round(stats.max_wait * 1000, 3),
+    )
+    return metrics
@@ -0,0 +1,352 @@
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import select, tuple_
+from models import db, Artist, Venue, Show, VenueShowCount, ArtistShowCount, Match
+
+# Statements of the read-only pages, and the functions turning their rows
+# into template data. They are plain select()s, so the Flask views run them
+# on db.session and the asyncio app (asgi.py) on an AsyncSession.
+#
+# Listings and searches take the genre, city and state filters of the request,
+# see listing_filters().
+#
+# *_version() statements return a single row that changes whenever the page
+# does, much cheaper than the page itself. ETags are computed from it, see
+# conditional requests in cache.py.
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+def venue_areas(filters=None):
+    # Every venue together with its area and upcoming shows count in a
+    # single query, the number of queries doesn't grow with venues or shows
+    query = select(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.updated_at,
+        db.func.coalesce(VenueShowCount.upcoming_shows_count, 0).label('num_upcoming_shows')
+    ).outerjoin(
+        VenueShowCount, VenueShowCount.venue_id == Venue.id
+    ).order_by(Venue.state, Venue.city, Venue.id)
+
+    return filter_listing(query, Venue, filters)
+
+def group_areas(rows):
+    areas = []
+    # Rows are ordered by area, so grouping them is a single pass
+    for (city, state), areaRows in groupby(rows, key=lambda row: (row.city, row.state)):
+        areas.append({
+            "city": city,
+            "state": state,
+            "venues": [{
+                "id": row.id,
+                "name": row.name,
+                "updated_at": row.updated_at,
+                "num_upcoming_shows": row.num_upcoming_shows
+            } for row in areaRows]
+        })
+    return areas
+
+def venue_detail(venue_id):
+    return select(Venue).where(Venue.id == venue_id).options(db.undefer_group('show_counts'))
+
+def venue_version(venue_id, now):
+    return detail_version(
+        Venue, venue_id, Show.venue_id,
+        Artist, Show.artist_id,
+        VenueShowCount, VenueShowCount.venue_id,
+        Match.venue_id, Match.artist_id,
+        now
+    )
+
+def venue_shows(venue_id, upcoming, now, per_page, after=None):
+    """A page of the upcoming shows of a venue, soonest first, or of its past
+    shows, latest first, with the artist of each."""
+    query = select(
+        Show.id,
+        Show.start_time,
+        Artist.id.label('artist_id'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Artist.updated_at.label('artist_updated_at')
+    ).join(Artist, Show.artist_id == Artist.id).where(Show.venue_id == venue_id)
+
+    return split_shows(query, upcoming, now, per_page, after)
+
+def venue_matches(venue_id, limit):
+    """Best matching artists of a venue, see matches.py."""
+    return select(
+        Artist.id.label('artist_id'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Artist.city,
+        Artist.state,
+        Match.score,
+        Match.genres
+    ).join(Artist, Match.artist_id == Artist.id).where(
+        Match.venue_id == venue_id
+    ).order_by(Match.score.desc(), Match.artist_id).limit(limit)
+
+
+#  Artists
+#  ----------------------------------------------------------------
+
+def artist_list(filters=None):
+    return filter_listing(select(Artist.id, Artist.name), Artist, filters)
+
+def artist_list_version():
+    # Deleted artists only show in the count, the listing has no
+    # Last-Modified time
+    return select(
+        db.func.max(Artist.updated_at).label('artists_updated_at'),
+        db.func.count().label('artists')
+    )
+
+def artist_version(artist_id, now):
+    return detail_version(
+        Artist, artist_id, Show.artist_id,
+        Venue, Show.venue_id,
+        ArtistShowCount, ArtistShowCount.artist_id,
+        Match.artist_id, Match.venue_id,
+        now
+    )
+
+def artist_detail(artist_id):
+    return select(Artist).where(Artist.id == artist_id).options(db.undefer_group('show_counts'))
+
+def artist_shows(artist_id, upcoming, now, per_page, after=None):
+    """A page of the upcoming shows of an artist, soonest first, or of its
+    past shows, latest first, with the venue of each."""
+    query = select(
+        Show.id,
+        Show.start_time,
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+        Venue.updated_at.label('venue_updated_at')
+    ).join(Venue, Show.venue_id == Venue.id).where(Show.artist_id == artist_id)
+
+    return split_shows(query, upcoming, now, per_page, after)
+
+def artist_matches(artist_id, limit):
+    """Best matching venues of an artist, see matches.py."""
+    return select(
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+        Venue.city,
+        Venue.state,
+        Match.score,
+        Match.genres
+    ).join(Venue, Match.venue_id == Venue.id).where(
+        Match.artist_id == artist_id
+    ).order_by(Match.score.desc(), Match.venue_id).limit(limit)
+
+
+#  Typeahead
+#  ----------------------------------------------------------------
+
+# Every named venue/artist with its upcoming shows count, loaded into the
+# typeahead index of each worker (see typeahead.py)
+
+def venue_names():
+    return select(
+        Venue.id,
+        Venue.name,
+        db.func.coalesce(VenueShowCount.upcoming_shows_count, 0)
+    ).outerjoin(VenueShowCount, VenueShowCount.venue_id == Venue.id).where(Venue.name.isnot(None))
+
+def artist_names():
+    return select(
+        Artist.id,
+        Artist.name,
+        db.func.coalesce(ArtistShowCount.upcoming_shows_count, 0)
+    ).outerjoin(ArtistShowCount, ArtistShowCount.artist_id == Artist.id).where(Artist.name.isnot(None))
+
+
+#  Filters
+#  ----------------------------------------------------------------
+
+# Genres are matched with the array operators the GIN indexes on
+# Venue.genres and Artist.genres serve: @> for venues/artists having every
+# genre asked for, && for those having any of them. City and state use the
+# (state, city) indexes.
+
+GENRE_MATCHES = ('all', 'any')
+
+def listing_filters(values):
+    """Filters of a listing or search from the request values, Eg:
+    ?genre=Jazz&genre=Blues&match=any&state=TX. Raises ValueError on an
+    unknown `match`."""
+    match = values.get('match', 'all')
+    if match not in GENRE_MATCHES:
+        raise ValueError(f'unknown genre match: {match}')
+
+    return {
+        "genres": [genre.strip() for genre in values.getlist('genre') if genre.strip()],
+        "match": match,
+        "city": values.get('city', '').strip() or None,
+        "state": values.get('state', '').strip() or None
+    }
+
+def filter_listing(query, model, filters):
+    if not filters:
+        return query
+
+    genres = filters['genres']
+    if genres and filters['match'] == 'all':
+        query = query.where(model.genres.contains(genres))
+    elif genres:
+        query = query.where(model.genres.overlap(genres))
+
+    if filters['city']:
+        query = query.where(model.city == filters['city'])
+    if filters['state']:
+        query = query.where(model.state == filters['state'])
+
+    return query
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+def split_shows(query, upcoming, now, per_page, after):
+    # Shows of a venue/artist are paged with keyset cursors on (start_time,
+    # id) like /shows, walking the (venue_id/artist_id, start_time, id) index
+    # forward for upcoming shows and backward for past ones. One extra row
+    # tells whether there is a next page.
+    key = tuple_(Show.start_time, Show.id)
+    if upcoming:
+        query = query.where(Show.start_time > now).order_by(Show.start_time, Show.id)
+        if after:
+            query = query.where(key > tuple_(*after))
+    else:
+        query = query.where(Show.start_time <= now).order_by(Show.start_time.desc(), Show.id.desc())
+        if after:
+            query = query.where(key < tuple_(*after))
+
+    return query.limit(per_page + 1)
+
+def detail_version(model, entity_id, show_key, other, other_key, counter, counter_key, match_key, match_other_key, now):
+    """Version of the detail page of a venue or artist: when it, one of its
+    shows or the artist/venue (`other`) of one or of one of its matches
+    changed last, its number of shows and when the last of them started
+    (moving it from upcoming to past), its show counts, and its number of
+    matches and when they were last computed. No row when the entity
+    doesn't exist."""
+    shows = select(
+        db.func.max(db.func.greatest(Show.updated_at, other.updated_at)).label('updated_at'),
+        db.func.max(Show.start_time).filter(Show.start_time <= now).label('last_started'),
+        db.func.count().label('shows')
+    ).join(other, other_key == other.id).where(show_key == entity_id).subquery()
+    matchedAt = select(db.func.max(Match.matched_at)).where(match_key == entity_id).scalar_subquery()
+    matchesUpdatedAt = select(db.func.max(other.updated_at)).join(
+        Match, match_other_key == other.id
+    ).where(match_key == entity_id).scalar_subquery()
+
+    return select(
+        db.func.greatest(model.updated_at, shows.c.updated_at, matchedAt, matchesUpdatedAt).label('updated_at'),
+        shows.c.last_started,
+        shows.c.shows,
+        counter.upcoming_shows_count,
+        counter.past_shows_count,
+        select(db.func.count()).where(match_key == entity_id).scalar_subquery().label('matches'),
+        matchedAt.label('matched_at')
+    ).select_from(model).join(shows, db.true()).outerjoin(
+        counter, counter_key == model.id
+    ).where(model.id == entity_id)
+
+def show_rows(rows):
+    return [row._asdict() for row in rows]
+
+def show_history(values):
+    """Upcoming or past shows (?when=upcoming, past by default) and the
+    cursor to continue after (?after=) of the shows page of a venue/artist.
+    Raises ValueError on an unknown `when` or a malformed cursor."""
+    when = values.get('when', 'past')
+    if when not in ('upcoming', 'past'):
+        raise ValueError(f'unknown shows: {when}')
+
+    cursor = values.get('after')
+    return when == 'upcoming', decode_show_cursor(cursor) if cursor else None
+
+def detail_page(entity, upcomingRows, pastRows, matchRows, per_page):
+    """Template data of a detail page, from the first page of its upcoming
+    and past shows. The `*_next` cursors continue them on the shows pages of
+    the venue/artist."""
+    upcoming, upcomingNext = next_page(list(upcomingRows), per_page)
+    past, pastNext = next_page(list(pastRows), per_page)
+    return {
+        **entity,
+        "past_shows": show_rows(past),
+        "past_shows_next": pastNext,
+        "upcoming_shows": show_rows(upcoming),
+        "upcoming_shows_next": upcomingNext,
+        "matches": show_rows(matchRows)
+    }
+
+# Listings are paged with keyset cursors on (start_time, id) instead of
+# OFFSET, so fetching any page costs the same however deep it is.
+# A cursor looks like "2019-05-21T21:30:00,42"
+
+def encode_show_cursor(start_time, show_id):
+    return f'{start_time.isoformat()},{show_id}'
+
+def decode_show_cursor(cursor):
+    # Raises ValueError on a malformed cursor
+    start_time, show_id = cursor.rsplit(',', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+
+def show_page(after, per_page):
+    # Joining artist and venue, and selecting only the columns the template
+    # uses, so a page of shows is a single query. Fetching one extra row
+    # tells whether there is a next page.
+    query = select(
+        Show.id,
+        Show.start_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Venue.updated_at.label('venue_updated_at'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Artist.updated_at.label('artist_updated_at')
+    ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+
+    if after:
+        afterTime, afterId = after
+        query = query.where(tuple_(Show.start_time, Show.id) > tuple_(afterTime, afterId))
+
+    return query.order_by(Show.start_time, Show.id).limit(per_page + 1)
+
+def next_page(rows, per_page):
+    """Returns the rows of a page fetched with one extra row, and the cursor
+    of the next page or None."""
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_show_cursor(rows[-1].start_time, rows[-1].id)
+    return rows, None
+
+def paginate_shows(rows, per_page):
+    """Returns the shows of a page and the cursor of the next one."""
+    rows, next_cursor = next_page(rows, per_page)
+
+    shows = [{
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name,
+        "venue_updated_at": row.venue_updated_at,
+        "artist_id": row.artist_id,
+        "artist_name": row.artist_name,
+        "artist_image_link": row.artist_image_link,
+        "artist_updated_at": row.artist_updated_at,
+        "start_time": row.start_time
+    } for row in rows]
+
+    return shows, next_cursor
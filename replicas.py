@@ -0,0 +1,199 @@
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+import random
+import threading
+import time
+from flask import current_app, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+# Replicas of the database (DATABASE_REPLICA_URLS) are binds of the Flask
+# app, named "replica:0", "replica:1"... Read-only requests (GET and HEAD)
+# run their selects on one of them, except that they stay on the primary:
+#   - once the session flushed, so a request reads its own writes
+#   - for clients whose requests wrote in the last REPLICA_STICKY_SECONDS,
+#     so they see their change on the page they are redirected to
+#   - for pages filling the page cache (see cache.cached_page) while their
+#     replica may not have replayed the commit that last invalidated pages,
+#     so it never keeps a page older than the invalidation
+# Writes, locking selects and text statements always run on the primary.
+#
+# A ReplicaMonitor thread checks the replay lag of every replica each
+# REPLICA_CHECK_INTERVAL seconds. Replicas lagging more than REPLICA_MAX_LAG
+# seconds, or failing the check, get no reads until they catch up;
+# /metrics/replicas reports them. Any database serves as a replica with no
+# lag, so two local instances are enough to try it out.
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds the replica is behind the primary, 0 when it replayed all it got
+LAG = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+END
+'''
+
+# Client session key of the time until which it reads from the primary
+PRIMARY_UNTIL = '_primary_until'
+
+
+def replica_names(config):
+    return [f'replica:{index}' for index in range(len(config['DATABASE_REPLICA_URLS']))]
+
+def replica_binds(config, options):
+    """SQLALCHEMY_BINDS of the replicas, engines configured with `options`
+    like the primary's."""
+    return {
+        name: {**options, 'url': url}
+        for name, url in zip(replica_names(config), config['DATABASE_REPLICA_URLS'])
+    }
+
+
+class ReplicaMonitor:
+
+    def __init__(self, app, names, interval, max_lag):
+        self.app = app
+        self.names = names
+        self.interval = interval
+        self.maxLag = max_lag
+        # Replicas get no reads before their first check
+        self.states = {name: {'lag': None, 'error': None, 'checked_at': None} for name in names}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Checks the replicas in a daemon thread, once."""
+        if self.thread is not None or not self.names:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.watch, name='fyyur-replicas', daemon=True)
+                self.thread.start()
+
+    def watch(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        with self.app.app_context():
+            engines = self.app.extensions['sqlalchemy'].engines
+            for name in self.names:
+                try:
+                    with engines[name].connect() as connection:
+                        state = {'lag': float(connection.exec_driver_sql(LAG).scalar()), 'error': None}
+                except Exception as error:
+                    state = {'lag': None, 'error': repr(error)}
+                state['checked_at'] = time.time()
+                self.states[name] = state
+
+    def replayed(self, name, since):
+        """Whether the replica `name` had replayed, when last checked, what
+        the primary committed by `since` (a time.time())."""
+        state = self.states[name]
+        return state['lag'] is not None and state['checked_at'] - state['lag'] >= since
+
+    def in_sync(self):
+        return [
+            name for name, state in self.states.items()
+            if state['lag'] is not None and state['lag'] <= self.maxLag
+        ]
+
+    def pick(self):
+        """A replica in sync, None when there is none."""
+        names = self.in_sync()
+        return random.choice(names) if names else None
+
+    def metrics(self):
+        urls = self.app.config['DATABASE_REPLICA_URLS']
+        return {
+            'max_lag': self.maxLag,
+            'replicas': [{
+                'name': name,
+                'url': make_url(url).render_as_string(hide_password=True),
+                'in_sync': name in self.in_sync(),
+                **self.states[name]
+            } for name, url in zip(self.names, urls)]
+        }
+
+
+def request_replica(monitor, method, client_session):
+    """Replica the reads of a request go to, None for the primary."""
+    if method not in READ_METHODS:
+        return None
+    if client_session.get(PRIMARY_UNTIL, 0) > time.time():
+        return None
+    return monitor.pick()
+
+
+#  Session
+#  ----------------------------------------------------------------
+
+class RoutingSession(Session):
+    """Session running the selects of read-only requests on the replica in
+    session.info['replica']."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and replica_read(clause):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def replica_read(clause):
+    # Plain selects, Eg: not SELECT ... FOR UPDATE
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+def read_own_writes(session, flush_context):
+    session.info.pop('replica', None)
+    session.info['wrote'] = True
+
+
+#  Requests
+#  ----------------------------------------------------------------
+
+def route_reads():
+    db = current_app.extensions['sqlalchemy']
+    monitor = current_app.extensions['replicas']
+    monitor.start()
+    db.session.info['replica'] = request_replica(monitor, request.method, session)
+
+def read_primary_unless_replayed(since):
+    """Moves the reads left in the request to the primary unless its replica
+    replayed what was committed by `since`, None for nothing to replay."""
+    dbSession = current_app.extensions['sqlalchemy'].session
+    replica = dbSession.info.get('replica')
+    if replica is not None and since is not None and not current_app.extensions['replicas'].replayed(replica, since):
+        dbSession.info.pop('replica')
+
+def stick_to_primary(response):
+    if current_app.extensions['sqlalchemy'].session.info.get('wrote'):
+        session[PRIMARY_UNTIL] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+def init_replica_binds(app):
+    """Adds the replicas to SQLALCHEMY_BINDS, call after init_pool() and
+    before db.init_app()."""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS', {}))
+    binds.update(replica_binds(app.config, app.config['SQLALCHEMY_ENGINE_OPTIONS']))
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+def init_replicas(app):
+    app.extensions['replicas'] = ReplicaMonitor(
+        app,
+        replica_names(app.config),
+        app.config['REPLICA_CHECK_INTERVAL'],
+        app.config['REPLICA_MAX_LAG']
+    )
+    if not app.config['DATABASE_REPLICA_URLS']:
+        return
+
+    app.before_request(route_reads)
+    app.after_request(stick_to_primary)
+    if not event.contains(RoutingSession, 'after_flush', read_own_writes):
+        event.listen(RoutingSession, 'after_flush', read_own_writes)
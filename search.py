@@ -0,0 +1,67 @@
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+import re
+from models import db
+from queries import filter_listing
+
+# Venue and Artist both carry a `search_vector` tsvector over name, genres,
+# city and state (GIN indexed), and a trigram GIN index on name. A search
+# matches on any of:
+#   - full-text, every word of the term used as a prefix ("jaz clu" finds
+#     "The Jazz Club")
+#   - trigram word similarity on name, tolerating typos ("Dueling Pinaos")
+#   - plain substring on name, which the trigram index also serves
+# All three are index backed, so there is no sequential scan per search.
+# Results can be narrowed with the genre, city and state filters of the
+# listings (see queries.py).
+# search_query() builds the statement, run by search() here and by the
+# asyncio app (asgi.py).
+
+def prefix_tsquery(search_term):
+    words = re.findall(r'\w+', search_term)
+    return ' & '.join(f'{word}:*' for word in words)
+
+def search_query(model, search_term, limit, filters=None):
+    search_term = search_term.strip()
+
+    query = db.select(
+        model.id,
+        model.name,
+        model.upcoming_shows_count.label('num_upcoming_shows'),
+        # Total number of matches, before the limit is applied
+        db.func.count().over().label('total')
+    )
+
+    if search_term:
+        words = prefix_tsquery(search_term)
+        tsquery = db.func.to_tsquery('simple', words)
+        matches = [
+            model.name.op('%>')(search_term),
+            model.name.ilike(f'%{search_term}%')
+        ]
+        # Terms made only of punctuation have no words to match on
+        if words:
+            matches.append(model.search_vector.op('@@')(tsquery))
+        rank = db.func.ts_rank(model.search_vector, tsquery) + db.func.word_similarity(search_term, model.name)
+
+        query = query.where(db.or_(*matches)).order_by(rank.desc(), model.name)
+    else:
+        query = query.order_by(model.name)
+
+    return filter_listing(query, model, filters).limit(limit)
+
+def search_results(rows):
+    return {
+        "count": rows[0].total if rows else 0,
+        "data": [{
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows
+        } for row in rows]
+    }
+
+def search(model, search_term, limit, filters=None):
+    rows = db.session.execute(search_query(model, search_term, limit, filters)).all()
+    return search_results(rows)
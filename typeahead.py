@@ -0,0 +1,473 @@
+#----------------------------------------------------------------------------#
+# Typeahead.
+#----------------------------------------------------------------------------#
+
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime
+from itertools import groupby, islice, takewhile
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show
+import queries
+
+# Names of venues and artists are completed from an index each worker holds
+# in memory, so a keystroke costs no query. Names are ranked by upcoming
+# shows, then by name, and found by any of their words: "The Musical Hop" by
+# "mus", "hop" or "the mu". For each kind of name the index keeps:
+#   - the distinct words in a sorted list, those a prefix starts are found
+#     with two bisections
+#   - the ranked names having each word, merged for prefixes starting a few
+#     words, Eg: "mus", and their ids
+#   - the best names of prefixes starting many words, Eg: "t", updated as
+#     names change
+# so a lookup reads about as many names as it returns, however many match.
+# Several words typed are looked up from the one the fewest names have,
+# reading its first names for the other words, then when too few have them,
+# intersecting the names of each word. A plain sorted list would rank every
+# name a prefix matches, hundreds of milliseconds for a letter typed at 100k
+# names (see benchmarks/typeahead.py, which also checks that an index updated
+# as names change answers like a rebuilt one).
+#
+# The index is built with the app when it's warmed up, otherwise on the
+# first lookup, then rebuilt from the database every
+# TYPEAHEAD_REFRESH_INTERVAL seconds, bringing in what other workers changed
+# and the shows that started since. Venues and artists this worker creates,
+# renames or deletes, and the shows it creates, update it when committed.
+
+KINDS = ('venue', 'artist')
+# Prefixes starting more distinct words than this keep their best names
+MERGED_WORDS = 32
+# Names of the typed word fewest names have read for the other words, before
+# the names of each word are intersected
+FILTERED_NAMES = 100
+# Past the last character a word can start with
+WORD_END = '\U0010ffff'
+
+
+def normalize(text):
+    # Case and accents don't matter, "Café" is found by "cafe"
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+def name_words(name):
+    # " the musical hop", a word starts wherever a space is followed
+    return ' ' + ' '.join(sorted(set(normalize(name).split())))
+
+def word_prefixes(words):
+    return {word[:end] for word in words.split() for end in range(len(word) + 1)}
+
+def has_words(words, typed):
+    return all(' ' + prefix in words for prefix in typed)
+
+
+class NameIndex:
+    """Names of the venues or the artists."""
+
+    def __init__(self, kind, rows, keep):
+        self.kind = kind
+        self.keep = keep
+        # id: (name, upcoming shows count, its words as name_words() joins them)
+        self.entries = {}
+        # Distinct word: ranks of the names having it, best first, and their
+        # ids to intersect them
+        self.runs = {}
+        self.ids = {}
+        # Prefix: ranks of its best names, for prefixes starting more than
+        # MERGED_WORDS distinct words. At most `keep`, fewer as names are
+        # removed from it, all of them for prefixes in `complete`.
+        self.tops = {}
+        self.complete = set()
+
+        names = []
+        for entityId, name, count in rows:
+            words = name_words(name)
+            self.entries[entityId] = (name, count, words)
+            names.append((rank(kind, entityId, name, count), words))
+        names.sort()
+        for ranked, words in names:
+            for word in words.split():
+                self.runs.setdefault(word, []).append(ranked)
+                self.ids.setdefault(word, set()).add(ranked[3])
+        self.words = sorted(self.runs)
+        # Every prefix keeping its best names, from the longest up
+        if len(self.words) > MERGED_WORDS:
+            self.best('', 0, len(self.words))
+
+    def word_range(self, prefix):
+        low = bisect_left(self.words, prefix)
+        return low, bisect_left(self.words, prefix + WORD_END, low)
+
+    def best(self, prefix, low, high):
+        """The best names with a word starting with `prefix`, the words
+        low:high, more than MERGED_WORDS."""
+        best = self.tops.get(prefix)
+        if best is None:
+            ranked = list(self.children(prefix, low, high))
+            # Names past the last of a list missing some aren't known
+            bound = min((items[-1] for items, complete in ranked if not complete), default=None)
+            merged = merge(items for items, _ in ranked)
+            if bound is not None:
+                merged = takewhile(lambda item: item <= bound, merged)
+
+            best = self.tops[prefix] = list(islice(merged, self.keep + 1))
+            if bound is None and len(best) <= self.keep:
+                self.complete.add(prefix)
+            del best[self.keep:]
+        return best
+
+    def children(self, prefix, low, high):
+        # The ranked names of the word `prefix` itself, then of the prefixes
+        # one letter longer, and whether they're all of them
+        if self.words[low] == prefix:
+            yield self.runs[prefix], True
+            low += 1
+        while low < high:
+            child = self.words[low][:len(prefix) + 1]
+            end = bisect_left(self.words, child + WORD_END, low, high)
+            if end - low > MERGED_WORDS:
+                yield self.best(child, low, end), child in self.complete
+            else:
+                for word in self.words[low:end]:
+                    yield self.runs[word], True
+            low = end
+
+    def names(self, low, high):
+        """How many names have the words low:high, or when the words are too
+        many to count them, how many words, fewer."""
+        if high - low > MERGED_WORDS:
+            return high - low
+        return sum(len(self.runs[word]) for word in self.words[low:high])
+
+    def search(self, typed, limit):
+        # From the typed word fewest names have, the others are filtered on
+        counted = sorted(
+            (self.names(*bounds), prefix, *bounds)
+            for prefix, bounds in zip(typed, map(self.word_range, typed))
+        )
+        _, prefix, low, high = counted[0]
+
+        if high - low > MERGED_WORDS:
+            # Enough of its best names matching are the best matches
+            best = self.best(prefix, low, high)
+            found = best if len(typed) == 1 else [item for item in best if has_words(self.entries[item[3]][2], typed)]
+            if len(found) >= limit or prefix in self.complete:
+                return found[:limit]
+
+        ranked = merge(self.runs[word] for word in self.words[low:high])
+        if len(typed) == 1:
+            return list(islice(ranked, limit))
+
+        found = []
+        for item in islice(ranked, FILTERED_NAMES):
+            if has_words(self.entries[item[3]][2], typed):
+                found.append(item)
+                if len(found) == limit:
+                    return found
+        if high - low <= MERGED_WORDS and counted[0][0] <= FILTERED_NAMES:
+            return found
+
+        # Few names have them all, they're found intersecting the names of
+        # each typed word, unless its words are too many to read them
+        matched = None
+        for _, _, low, high in counted:
+            if high - low > MERGED_WORDS:
+                continue
+            words = self.words[low:high]
+            ids = self.ids[words[0]] if len(words) == 1 else set().union(*(self.ids[word] for word in words))
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                return []
+        if matched is None:
+            return found + list(islice(
+                (item for item in ranked if has_words(self.entries[item[3]][2], typed)),
+                limit - len(found)
+            ))
+        return heapq.nsmallest(limit, (
+            rank(self.kind, entityId, name, count)
+            for entityId in matched
+            for name, count, words in [self.entries[entityId]]
+            if has_words(words, typed)
+        ))
+
+    def link(self, entity_id, name, count):
+        words = name_words(name)
+        ranked = rank(self.kind, entity_id, name, count)
+        self.entries[entity_id] = (name, count, words)
+        for word in words.split():
+            run = self.runs.get(word)
+            if run is None:
+                self.runs[word] = [ranked]
+                self.ids[word] = {entity_id}
+                insort(self.words, word)
+            else:
+                insort(run, ranked)
+                self.ids[word].add(entity_id)
+
+        for prefix in word_prefixes(words):
+            best = self.tops.get(prefix)
+            # Names past the last one kept aren't known
+            if best is not None and (prefix in self.complete or (best and ranked < best[-1])):
+                insort(best, ranked)
+                if len(best) > self.keep:
+                    best.pop()
+                    self.complete.discard(prefix)
+
+    def unlink(self, entity_id):
+        entry = self.entries.pop(entity_id, None)
+        if entry is None:
+            return None
+
+        name, count, words = entry
+        ranked = rank(self.kind, entity_id, name, count)
+        for word in words.split():
+            run = self.runs[word]
+            remove_sorted(run, ranked)
+            self.ids[word].discard(entity_id)
+            if not run:
+                del self.runs[word]
+                del self.ids[word]
+                remove_sorted(self.words, word)
+
+        for prefix in word_prefixes(words):
+            best = self.tops.get(prefix)
+            if best is not None:
+                remove_sorted(best, ranked)
+                # Merged again from the longer prefixes on its next lookup
+                if len(best) < self.keep // 2 and prefix not in self.complete:
+                    del self.tops[prefix]
+        return entry
+
+
+class PrefixIndex:
+    """Names of venues and artists, ranked by upcoming shows then by name.
+    Lookups return at most `keep` // 2 of them."""
+
+    def __init__(self, rows=(), keep=40):
+        byKind = {kind: [] for kind in KINDS}
+        for kind, entityId, name, count in rows:
+            byKind[kind].append((entityId, name, count))
+        self.kinds = {kind: NameIndex(kind, kindRows, keep) for kind, kindRows in byKind.items()}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(names.entries) for names in self.kinds.values())
+
+    def put(self, kind, entity_id, name, count=None):
+        """Adds or renames a venue/artist, `count` None keeps its count. One
+        without a name can't be typed, it's removed."""
+        names = self.kinds[kind]
+        with self.lock:
+            entry = names.unlink(entity_id)
+            if name is None:
+                return
+            if count is None:
+                count = entry[1] if entry else 0
+            names.link(entity_id, name, count)
+
+    def remove(self, kind, entity_id):
+        with self.lock:
+            self.kinds[kind].unlink(entity_id)
+
+    def add_upcoming(self, kind, entity_id, shows):
+        names = self.kinds[kind]
+        with self.lock:
+            entry = names.unlink(entity_id)
+            if entry is not None:
+                names.link(entity_id, entry[0], entry[1] + shows)
+
+    def search(self, text, limit, kind=None):
+        """The `limit` best matches of `text` as (kind, id, name, count), only
+        venues or artists when `kind` is given. Every word typed must start a
+        word of the name."""
+        typed = normalize(text).split()
+        if not typed or limit < 1:
+            return []
+
+        with self.lock:
+            kinds = [self.kinds[kind]] if kind else self.kinds.values()
+            found = [names.search(typed, limit) for names in kinds]
+        return [result(ranked) for ranked in islice(heapq.merge(*found), limit)]
+
+
+def merge(ranked):
+    # Names having several of the words merged come once
+    return (item for item, _ in groupby(heapq.merge(*ranked)))
+
+def rank(kind, entity_id, name, count):
+    return (-count, name, kind, entity_id)
+
+def result(ranked):
+    negCount, name, kind, entityId = ranked
+    return kind, entityId, name, -negCount
+
+def remove_sorted(items, item):
+    index = bisect_left(items, item)
+    if index < len(items) and items[index] == item:
+        del items[index]
+
+
+def search_args(values, config):
+    """Text, kind and limit of a lookup from the request values, Eg:
+    ?q=mus&type=venue&limit=5. Raises ValueError on an unknown `type` or a
+    malformed `limit`."""
+    kind = values.get('type') or None
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f'unknown type: {kind}')
+    limit = int(values.get('limit', config['TYPEAHEAD_LIMIT']))
+    return values.get('q', ''), kind, max(1, min(limit, config['TYPEAHEAD_MAX_LIMIT']))
+
+def search_results(text, results, url_for):
+    """JSON of a lookup, with the page of each venue/artist."""
+    return {'q': text, 'results': [{
+        'type': kind,
+        'id': entityId,
+        'name': name,
+        'upcoming_shows': count,
+        'url': url_for(f'main.show_{kind}', **{f'{kind}_id': entityId})
+    } for kind, entityId, name, count in results]}
+
+
+def load_index(max_limit):
+    rows = [('venue', *row) for row in db.session.execute(queries.venue_names())]
+    rows += [('artist', *row) for row in db.session.execute(queries.artist_names())]
+    # Twice the names returned are kept, so removing some rarely needs
+    # merging them again
+    return PrefixIndex(rows, keep=2 * max_limit)
+
+
+class Typeahead:
+    """The index of a worker and the thread rebuilding it."""
+
+    def __init__(self, app, refresh_interval):
+        self.app = app
+        self.refreshInterval = refresh_interval
+        self.index = None
+        # Names changed while the index is rebuilt, the database may have
+        # been read before they were committed
+        self.pending = None
+        self.changesLock = threading.Lock()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        with self.changesLock:
+            self.pending = []
+        try:
+            with self.app.app_context():
+                try:
+                    index = load_index(self.app.config['TYPEAHEAD_MAX_LIMIT'])
+                finally:
+                    db.session.remove()
+        except Exception:
+            with self.changesLock:
+                self.pending = None
+            raise
+
+        # The new index replaces the old one whole, lookups never see it half
+        # built
+        with self.changesLock:
+            for change in self.pending:
+                apply_change(index, *change)
+            self.index = index
+            self.pending = None
+
+    def get(self):
+        """The index, built on the first call unless the app was warmed up."""
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.build()
+        self.start()
+        return self.index
+
+    def start(self):
+        """Rebuilds the index in a daemon thread, once. Started by the first
+        lookup, so a pre-forking server forks workers before it exists."""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.refresh, name='fyyur-typeahead', daemon=True)
+                self.thread.start()
+
+    def refresh(self):
+        while True:
+            time.sleep(self.refreshInterval)
+            try:
+                self.build()
+            except Exception:
+                self.app.logger.exception('Rebuilding the typeahead index failed')
+
+    def apply(self, changes):
+        with self.changesLock:
+            if self.pending is not None:
+                # Show counts are left to the next rebuild, the one under way
+                # may have counted the show already
+                self.pending.extend(change for change in changes if change[0] != 'shows')
+            if self.index is not None:
+                for change in changes:
+                    apply_change(self.index, *change)
+
+
+#  Session hooks
+#  ----------------------------------------------------------------
+
+# Changes are collected when flushed and applied once committed, a rolled
+# back transaction leaves the index as it was.
+
+def collect_changes(session, flush_context):
+    changes = session.info.setdefault('typeahead', [])
+    now = datetime.now()
+    for obj in session.new:
+        if isinstance(obj, (Venue, Artist)):
+            changes.append(('put', type(obj).__name__.lower(), obj.id, obj.name, 0))
+        elif isinstance(obj, Show) and upcoming_show(obj, now):
+            changes.append(('shows', 'venue', int(obj.venue_id), 1))
+            changes.append(('shows', 'artist', int(obj.artist_id), 1))
+
+    for obj in session.dirty:
+        if isinstance(obj, (Venue, Artist)) and db.inspect(obj).attrs.name.history.has_changes():
+            changes.append(('put', type(obj).__name__.lower(), obj.id, obj.name, None))
+
+    for obj in session.deleted:
+        if isinstance(obj, (Venue, Artist)):
+            changes.append(('remove', type(obj).__name__.lower(), obj.id))
+
+def upcoming_show(show, now):
+    # Shows created from the form still hold its strings after the flush,
+    # Eg: "2030-01-01 20:00:00". The next rebuild counts any other format.
+    startTime = show.start_time
+    if isinstance(startTime, str):
+        try:
+            startTime = datetime.fromisoformat(startTime)
+        except ValueError:
+            return False
+    return startTime.replace(tzinfo=None) > now
+
+def apply_change(index, change, *args):
+    if change == 'put':
+        index.put(*args)
+    elif change == 'remove':
+        index.remove(*args)
+    else:
+        index.add_upcoming(*args)
+
+def apply_changes(session):
+    changes = session.info.pop('typeahead', None)
+    if changes and has_app_context() and 'typeahead' in current_app.extensions:
+        current_app.extensions['typeahead'].apply(changes)
+
+def discard_changes(session):
+    session.info.pop('typeahead', None)
+
+def init_typeahead(app):
+    app.extensions['typeahead'] = Typeahead(app, app.config['TYPEAHEAD_REFRESH_INTERVAL'])
+    if not event.contains(Session, 'after_flush', collect_changes):
+        event.listen(Session, 'after_flush', collect_changes)
+        event.listen(Session, 'after_commit', apply_changes)
+        event.listen(Session, 'after_rollback', discard_changes)